@@ -52,7 +52,17 @@ async function getLedgerResources(user_id){
 					                </th>
 					              </thead>`
 
-			const response_array = await JSON.parse(await response.json());
+			// the ledger comes a page at a time; X-Next-Cursor is set while there are more pages to get
+			let response_array = await JSON.parse(await response.json());
+			let cursor = response.headers.get("X-Next-Cursor");
+			while (cursor !== null) {
+				const page = await fetch(BASE + "ledger/" + user_id + "?cursor=" + encodeURIComponent(cursor));
+				if (!page.ok) {
+					throw new Error('Error retrieving ledger.');
+				}
+				response_array = response_array.concat(await JSON.parse(await page.json()));
+				cursor = page.headers.get("X-Next-Cursor");
+			}
 
 			for (let i = 0; i < response_array.length; i++) {
 			    const obj = await JSON.parse(response_array[i]);
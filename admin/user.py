@@ -9,7 +9,7 @@ import mysql.connector
 import mysql.connector.cursor
 import requests
 
-from transactions import ledger
+from transactions import ledger, transaction
 
 
 class UserError(Exception):
@@ -157,6 +157,9 @@ class User:
         for pair_id in pair_ids:
             cur.execute("""DELETE FROM pairs WHERE id = %s""", [pair_id[0]])
 
+        if self.u_id is not None:
+            transaction.forget_pairs(self.u_id)
+
         # now all fks have been deleted - delete user
         cur.execute("""DELETE FROM user WHERE id = %s""", [self.u_id])
         conn.commit()
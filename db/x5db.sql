@@ -93,7 +93,10 @@ CREATE TABLE pairs (
 
     PRIMARY KEY (id),
     FOREIGN KEY (src) REFERENCES user(id),
-    FOREIGN KEY (dest) REFERENCES user(id)
+    FOREIGN KEY (dest) REFERENCES user(id),
+
+    -- one row per (src, dest), so a pair can be added or got back in one query
+    UNIQUE INDEX src_dest (src, dest)
 );
 
 CREATE TABLE transaction (
@@ -101,9 +104,12 @@ CREATE TABLE transaction (
     pair_id INT,
     amount INT,
     description VARCHAR(256),
-    due_date DATE,
+    due_date DATE NOT NULL,
     paid TINYINT DEFAULT 0,
 
     PRIMARY KEY (id),
-    FOREIGN KEY (pair_id) REFERENCES pairs(id)
+    FOREIGN KEY (pair_id) REFERENCES pairs(id),
+
+    -- ledger pages are read in (due_date, id) order, one pair at a time
+    INDEX pair_due (pair_id, due_date, id)
 );
\ No newline at end of file
@@ -25,6 +25,9 @@ def attach(api: flask_restful.Api):
     # transactions
     api.add_resource(tr.TransactionResource, "/transaction/<int:t_id>", "/transaction")
     api.add_resource(lr.LedgerResource, "/ledger/<int:user_id>", "/simplify/<int:house_id>")
+    api.add_resource(lr.SimplificationPreview, "/simplify/<int:house_id>/preview")
+    api.add_resource(lr.SimplifiedGraphResource, "/simplify/<int:house_id>/graph")
+    api.add_resource(lr.HouseholdBalances, "/balances/<int:house_id>")
     api.add_resource(tr.CalendarTransactions, "/transaction/as_events/<int:user_id>")
 
     # users
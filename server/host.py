@@ -20,12 +20,13 @@ CORS(app, resources={
     r"/list_events/*": {"origins": "*"},
     r"/list_event_details/*": {"origins": "*"},
     r"/transaction/*": {"origins": "*"},
-    r"/ledger/*": {"origins": "*"},
+    r"/ledger/*": {"origins": "*", "expose_headers": ["X-Next-Cursor"]},
     r"/user/*": {"origins": "*"},
     r"/house/*": {"origins": "*"},
     r"/user_profile/*": {"origins": "*"},
     r"/group_details/*": {"origins": "*"},
     r"/simplify/*": {"origins": "*"},
+    r"/balances/*": {"origins": "*"},
     r"/transaction/as_events/*": {"origins": "*"},
     r"/login": {"origins": "*"}
 })
@@ -1,7 +1,34 @@
+from datetime import date
+
+from flask import Response, request, stream_with_context
 from flask_restful import Resource
 
 from server import db_handler as db
-from transactions.ledger import Ledger, LedgerConstructionError, SimplificationError, EmptyLedger
+from settle.flow_algorithms import Budget, NoSimplification
+from transactions import render
+from transactions.ledger import (
+    Ledger,
+    LedgerConstructionError,
+    SimplificationError,
+    EmptyLedger,
+    InvalidCursor,
+    MAX_PAGE_SIZE,
+    PAGE_SIZE,
+    SIMPLIFY_METHODS,
+)
+
+# how long /simplify may spend simplifying, unless the request says otherwise with ?budget_ms
+SIMPLIFY_BUDGET_MS = 2000
+
+
+def _request_budget() -> Budget | None:
+    """Returns a budget of the request's ?budget_ms, or None if that isn't a positive whole number"""
+    try:
+        budget_ms = int(request.args.get("budget_ms", SIMPLIFY_BUDGET_MS))
+    except ValueError:
+        return None
+
+    return Budget(seconds=budget_ms / 1000) if budget_ms > 0 else None
 
 
 class LedgerResource(Resource):
@@ -10,10 +37,72 @@ class LedgerResource(Resource):
     """
 
     def get(self, user_id: int):
-        """Given a user id, will return a 'ledger' of all user's transaction_resources whether they are src or dest"""
+        """Given a user id, will return a 'ledger' of the user's transaction_resources whether they are src or dest,
+        ordered by due date. Filter with ?paid=true|false, ?counterparty=<user id> and ?due_from / ?due_to=yyyy-mm-dd
+        (inclusive).
+
+        At most ?limit transactions (PAGE_SIZE by default) are returned. Where there are more, the X-Next-Cursor
+        header holds a token; pass it back as ?cursor to get the next page.
+
+        With ?stream=true every matching transaction is returned instead (?limit is ignored), as a JSON list of
+        objects streamed out while the rows are read, so memory use doesn't grow with the ledger
+        """
+        args = request.args
         try:
-            ledger = Ledger.build_from_user_id(user_id, db.get_db())
-            return ledger.json, 200
+            paid = {None: None, "true": True, "false": False}[args.get("paid")]
+            counterparty = args.get("counterparty", type=int)
+            due_from = (
+                date.fromisoformat(args["due_from"]) if "due_from" in args else None
+            )
+            due_to = date.fromisoformat(args["due_to"]) if "due_to" in args else None
+            limit = int(args.get("limit", PAGE_SIZE))
+        except (KeyError, ValueError):
+            return (
+                "paid must be true or false, dates yyyy-mm-dd and limit a whole number",
+                400,
+            )
+
+        if "counterparty" in args and counterparty is None:
+            return "counterparty must be a user id", 400
+
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            return f"limit must be between 1 and {MAX_PAGE_SIZE}", 400
+
+        try:
+            if args.get("stream") == "true":
+                transactions = Ledger.stream(
+                    user_id,
+                    db.get_db(),
+                    paid,
+                    counterparty,
+                    due_from,
+                    due_to,
+                    args.get("cursor"),
+                )
+                return Response(
+                    stream_with_context(Ledger.json_chunks(transactions)),
+                    mimetype="application/json",
+                )
+
+            page = Ledger.page(
+                user_id,
+                db.get_db(),
+                paid,
+                counterparty,
+                due_from,
+                due_to,
+                args.get("cursor"),
+                limit,
+            )
+            headers = (
+                {"X-Next-Cursor": page.next_cursor}
+                if page.next_cursor is not None
+                else {}
+            )
+            return page.ledger.json, 200, headers
+
+        except InvalidCursor:
+            return "Invalid cursor", 400
 
         except LedgerConstructionError:
             return "Could not return given user's transaction_resources", 404
@@ -22,17 +111,104 @@ class LedgerResource(Resource):
             return "The ledger was empty", 404
 
     def post(self, house_id: int):
-        """Simplifies ledger"""
+        """Simplifies ledger. Choose how with ?method=max_flow (default) or ?method=greedy.
+        With ?incremental=true the household's simplified graph is kept, and transactions posted later are folded
+        into it instead of simplifying the whole ledger again.
+
+        Simplifying stops after ?budget_ms milliseconds (SIMPLIFY_BUDGET_MS by default), writing what it has found so
+        far; the response then says the ledger was partly simplified, and posting again simplifies it further
+        """
+
+        method = request.args.get("method", "max_flow")
+        incremental = request.args.get("incremental", "false") == "true"
+        if method not in SIMPLIFY_METHODS:
+            return f"Unknown simplification method '{method}'", 400
+
+        # the clock starts now, so loading the ledger counts towards the budget
+        if (budget := _request_budget()) is None:
+            return "budget_ms must be a positive whole number of milliseconds", 400
 
         conn, cur = db.get_conn()
 
+        # Ledger.simplify loads the ledger itself, after checking for a cached result
         try:
-            l = Ledger.build_from_house_id(house_id, cur)
+            plan = Ledger.simplify(house_id, cur, conn, method, incremental, budget)
+            if plan.partial:
+                return (
+                    "Partly simplified in the time allowed; simplify again to carry on",
+                    201,
+                )
+            return 201
         except LedgerConstructionError:
             return f"Failed to access transactions for household {house_id}"
-
-        try:
-            l.simplify(house_id, cur, conn)
-            return 201
+        except NoSimplification:
+            if budget.ran_out:
+                return "No simplifications found in the time allowed", 200
+            return "No simplifications found", 200
         except SimplificationError as se:
             return str(se), 500
+
+
+class HouseholdBalances(Resource):
+    """How much each member of a household is owed overall, across its unpaid transactions"""
+
+    def get(self, house_id: int):
+        """Returns each user's balance, as in Ledger.balances_json. Large ledgers are summed with numpy (see
+        Ledger.balances)"""
+        try:
+            return Ledger.build_from_house_id(house_id, db.get_db()).balances_json, 200
+        except LedgerConstructionError:
+            return f"Failed to access transactions for household {house_id}", 404
+
+
+class SimplificationPreview(Resource):
+    """How /simplify would change a household's transactions, without changing them"""
+
+    def get(self, house_id: int):
+        """Returns the transfers the household's unpaid transactions would be replaced with, and how many fewer
+        transactions there would be (see SimplificationPlan.json). Takes the same ?method and ?budget_ms as
+        POST /simplify; the plan is kept, so posting to /simplify straight after writes it without working it
+        out again"""
+
+        method = request.args.get("method", "max_flow")
+        if method not in SIMPLIFY_METHODS:
+            return f"Unknown simplification method '{method}'", 400
+
+        if (budget := _request_budget()) is None:
+            return "budget_ms must be a positive whole number of milliseconds", 400
+
+        try:
+            return (
+                Ledger.plan(
+                    house_id, db.get_db(), method, budget=budget, keep_partial=True
+                ).json,
+                200,
+            )
+        except LedgerConstructionError:
+            return f"Failed to access transactions for household {house_id}", 404
+        except NoSimplification:
+            return "No simplifications found", 200
+
+
+class SimplifiedGraphResource(Resource):
+    """The household's latest simplified debt graph, rendered as an SVG (or as DOT source with ?format=dot).
+    Graphs are rendered here, on first request, rather than while simplifying"""
+
+    def get(self, house_id: int):
+        if (key := render.latest.get(house_id)) is None:
+            return f"Household {house_id} has not been simplified", 404
+
+        if request.args.get("format") == "dot":
+            source = render.dot_source(key)
+            return (
+                Response(source, mimetype="text/vnd.graphviz")
+                if source is not None
+                else ("Graph expired", 404)
+            )
+
+        image = render.svg(key)
+        return (
+            Response(image, mimetype="image/svg+xml")
+            if image is not None
+            else ("Graph expired", 404)
+        )
@@ -65,6 +65,10 @@ class TransactionResource(Resource):
         except TransactionInsertionFailed:
             return json.dumps("Adding transaction failed"), 500
 
+        # cached simplifications of the household are out of date; keep its incremental graph up to date
+        ledger.Ledger.invalidate(house_id=trn.house_id)
+        ledger.Ledger.fold_in(trn)
+
         return trn.json, 201
 
     def patch(self, t_id: int):
@@ -79,6 +83,7 @@ class TransactionResource(Resource):
             "UPDATE transaction SET paid = 1 - paid WHERE id = %s", [t_id]
         )
         conn.commit()
+        ledger.Ledger.invalidate(t_id=t_id)
 
         cur.execute("""SELECT count(*) FROM transaction WHERE id = %s""", [t_id])
 
@@ -102,6 +107,7 @@ class TransactionResource(Resource):
 
         cur.execute("DELETE FROM transaction WHERE id = %s", [t_id])
         conn.commit()
+        ledger.Ledger.invalidate(t_id=t_id)
 
         cur.execute("SELECT pair_id FROM transaction WHERE id = %s", [t_id])
         result = cur.fetchone()
@@ -1,10 +1,13 @@
 """Defines the flow graph structure"""
 from __future__ import annotations
 
-import copy
-from dataclasses import dataclass
+import struct
+from array import array
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from itertools import accumulate, repeat
 from os import getcwd
-from typing import Callable
+from typing import Callable, Iterable, Iterator, Sequence
 
 import graphviz  # type: ignore
 
@@ -21,16 +24,45 @@ class OverFlowError(Exception):
     ...
 
 
-@dataclass
+# packed graphs (see FlowGraph.pack) start with a header of: format tag, number of vertices, number of edges and
+# length of the labels in bytes
+PACK_HEADER = struct.Struct("=4sQQQ")
+PACK_TAG = b"FG01"
+
+
+@dataclass(slots=True, eq=False)
 class Vertex:
+    """A person in the graph. Vertices are dict keys in every search, so the hash is worked out once, up front.
+    v_id and label mustn't be changed after the vertex is made"""
+
     v_id: int
     label: str
+    _hash: int = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self._hash = hash((self.v_id, self.label))
 
     def __hash__(self):
-        return hash(f"{self.v_id}{self.label}")
+        return self._hash
+
+    def __eq__(self, other):
+        # graphs intern their vertices, so this is usually the same object
+        if self is other:
+            return True
+        if other.__class__ is not Vertex:
+            return NotImplemented
+        return (
+            self._hash == other._hash
+            and self.v_id == other.v_id
+            and self.label == other.label
+        )
+
+    def __reduce__(self):
+        # str hashes differ between processes, so the hash is worked out again when unpickled
+        return Vertex, (self.v_id, self.label)
 
 
-@dataclass
+@dataclass(slots=True)
 class Edge:
     target: Vertex
     flow: int
@@ -63,6 +95,64 @@ class Edge:
             self.flow += flow
 
 
+def _pack(
+    vertices: list[Vertex], src: array, target: array, flow: array, capacity: array
+) -> bytes:
+    """Packs a graph given as its vertices and, for every edge, the positions of its src and target vertices
+    (32-bit arrays) and its flow and capacity (64-bit arrays).
+
+    After PACK_HEADER come the vertex ids and the offsets of each vertex's label (64-bit), the flow and capacity
+    arrays, the src and target arrays, then the utf-8 labels. Numbers are in native byte order, and every array
+    starts on a multiple of its item size, so the arrays can be read in place from an mmap or shared memory
+    """
+    labels = [v.label.encode() for v in vertices]
+    text = b"".join(labels)
+
+    return b"".join(
+        (
+            PACK_HEADER.pack(PACK_TAG, len(vertices), len(src), len(text)),
+            array("q", [v.v_id for v in vertices]).tobytes(),
+            array("q", accumulate(map(len, labels), initial=0)).tobytes(),
+            flow.tobytes(),
+            capacity.tobytes(),
+            src.tobytes(),
+            target.tobytes(),
+            text,
+        )
+    )
+
+
+def _unpack(
+    data: bytes | bytearray | memoryview,
+) -> tuple[list[Vertex], array, array, array, array]:
+    """Reverse of _pack: returns the vertices and the src, target, flow and capacity arrays"""
+    tag, n, m, text_length = PACK_HEADER.unpack_from(data)
+    if tag != PACK_TAG:
+        raise FlowGraphError("Not a packed flow graph")
+
+    with memoryview(data) as view:
+        position = PACK_HEADER.size
+
+        def take(typecode: str, count: int) -> array:
+            nonlocal position
+            values = array(typecode)
+            values.frombytes(view[position : position + values.itemsize * count])
+            position += values.itemsize * count
+            return values
+
+        ids, offsets = take("q", n), take("q", n + 1)
+        flow, capacity = take("q", m), take("q", m)
+        src, target = take("i", m), take("i", m)
+        text = bytes(view[position : position + text_length])
+
+    vertices = [
+        Vertex(v_id, text[offsets[i] : offsets[i + 1]].decode())
+        for i, v_id in enumerate(ids)
+    ]
+
+    return vertices, src, target, flow, capacity
+
+
 class FlowGraph:
     """Graph with edges and residual edges. Stored as an adjacency list.
 
@@ -80,12 +170,65 @@ class FlowGraph:
         # If we have been provided with a graph use the graph. If not, generate an empty dict from our list of vertices
         self.graph = graph if graph is not None else {v: [] for v in vertices}
 
+        # intern table: every vertex in the graph maps to itself, so edges can point at the same vertex objects as
+        # the graph's keys (see intern)
+        self._interned: dict[Vertex, Vertex] = {v: v for v in self.graph.keys()}
+
+        # incoming edge index: vertex -> vertices with an edge (normal or residual) to it, kept in step with the
+        # adjacency lists so edges into a vertex can be found without looking through the whole graph
+        self._incoming: dict[Vertex, dict[Vertex, None]] = {
+            v: {} for v in self.graph.keys()
+        }
+
+        for u, edges in self.graph.items():
+            for edge in edges:
+                edge.target = self.intern(edge.target)
+                self._incoming.setdefault(edge.target, {})[u] = None
+
     def __eq__(self, other: FlowGraph) -> bool:
         return self.graph == other.graph
 
+    @classmethod
+    def from_debts(
+        cls, vertices: list[Vertex], debts: Iterable[tuple[Vertex, Vertex, int]]
+    ) -> FlowGraph:
+        """Builds a graph from (src, target, amount) debts, netting debts between the same two vertices in one pass.
+        Debts going the same way are summed and debts going opposite ways cancel, so each pair of vertices ends
+        up with at most one edge (and FlowGraphError("Edge going in two directions") can't be raised)
+        """
+        net: dict[tuple[Vertex, Vertex], int] = {}
+        for src, target, amount in debts:
+            # owing yourself money doesn't need settling
+            if src == target:
+                continue
+
+            if (target, src) in net:
+                net[(target, src)] -= amount
+            else:
+                net[(src, target)] = net.get((src, target), 0) + amount
+
+        graph = cls(vertices=vertices)
+        for (src, target), amount in net.items():
+            if amount > 0:
+                graph.add_edge(edge=Edge(target, 0, amount), src=src)
+            elif amount < 0:
+                graph.add_edge(edge=Edge(src, 0, -amount), src=target)
+
+        return graph
+
+    def intern(self, v: Vertex) -> Vertex:
+        """Returns the graph's own vertex equal to v, or v if the graph doesn't have it.
+        Dict lookups of the same object never have to call Vertex.__eq__"""
+        return self._interned.get(v, v)
+
     def add_vertex(self, v: Vertex):
         """Adds a vertex with no edges to the graph"""
+        for edge in self.graph.get(v, []):
+            self._incoming[edge.target].pop(v, None)
+
         self.graph[v] = []
+        self._interned[v] = v
+        self._incoming.setdefault(v, {})
 
     def augment_flow(self, path: list[Vertex], flow: int):
         for u, v in zip(path, path[1:]):
@@ -98,14 +241,12 @@ class FlowGraph:
                     edge.push_flow(-1 * flow)
 
     def remove_vertex(self, v: Vertex):
-        """Removes a vertex, and all of its incoming / outgoing edges from a graph"""
+        """Removes a vertex, and all of its incoming / outgoing edges from a graph.
+        Only v's own edges and the vertices in its incoming index are looked at, so this is O(degree of v)
+        """
 
         # delete all edges which have v listed as the target
-        for src in self.graph.keys():
-            # skip the vertex we are deleting as we cannot have edges from v -> v
-            if src == v:
-                continue
-
+        for src in list(self._incoming[v]):
             # if an edge exists between vertex and v, delete it
             if self.unused_capacity(src, v) != -1:
                 self.remove_edge(src=src, target=v)
@@ -115,15 +256,25 @@ class FlowGraph:
         for edge in edges_from_v:
             self.remove_edge(src=v, target=edge.target)
 
+        # drop anything left over (e.g. residual edges whose normal edge was added without one)
+        for src in self._incoming.pop(v):
+            self.graph[src] = [edge for edge in self.graph[src] if edge.target != v]
+        for edge in self.graph[v]:
+            self._incoming[edge.target].pop(v, None)
+
         # pop node from graph
         self.graph.pop(v)
+        self._interned.pop(v, None)
 
     def add_edge(self, *, edge: Edge, src: Vertex, add_residual=True):
         """Adds an edge to the flow graph from a given vertex. Will also add the residual edge by default"""
+        src = self.intern(src)
+        edge.target = self.intern(edge.target)
 
         # append edge to the list if the edge doesn't exist
         if self.unused_capacity(src, edge.target) == -1:
             self.graph[src].append(edge)
+            self._incoming[edge.target][src] = None
         else:
             present_edge = self.get_edge(src, edge.target)
             self.remove_edge(src=src, target=present_edge.target)
@@ -136,6 +287,9 @@ class FlowGraph:
                 ),
             )
 
+            # the recursive call has already added the residual edge for the merged edge
+            return
+
         # if we add an edge going opposite the edge that already exists throw an error
         # this should be cleaned **before**
         if len(
@@ -153,6 +307,7 @@ class FlowGraph:
             res = Edge(src, 0, 0)
 
             self.graph[edge.target].append(res)
+            self._incoming[src][edge.target] = None
 
     def remove_edge(self, *, src: Vertex, target: Vertex):
         """Removes an edge given it exists. Can only remove edges that exist. Residual edges removed automatically"""
@@ -165,9 +320,11 @@ class FlowGraph:
 
         # delete edge
         self.graph[src].remove(self.get_edge(src, target))
+        self._incoming[target].pop(src, None)
 
         # delete residual edge
         self.graph[target].remove(self.get_edge(target, src, True))
+        self._incoming[src].pop(target, None)
 
     def neighbours(self, current: Vertex) -> list[Vertex]:
         """Returns the neighbours of the current node
@@ -181,6 +338,14 @@ class FlowGraph:
             and not neighbouring_edge.saturated
         ]
 
+    def open_edges(self, current: Vertex) -> list[tuple[Vertex, int]]:
+        """Returns (neighbour, unused capacity) for every edge out of current with capacity left, residual or not"""
+        return [
+            (edge.target, edge.capacity - edge.flow)
+            for edge in self.graph[current]
+            if edge.capacity > edge.flow
+        ]
+
     def unused_capacity(self, u: Vertex, v: Vertex, residual: bool = False) -> int:
         """Returns the unused capacity of an edge between two nodes. If there is no edge between the nodes return -1.
         Should also be used as test to see if edge exists.
@@ -221,33 +386,137 @@ class FlowGraph:
         [fn(edge, *args, **kwargs) for edge in self.graph[u] if edge.target == v]
 
     def prune_edges(self):
-        """Replace edges in graph with an edge of flow 0, capacity of unused capacity"""
-
-        # create deep copy of original graph structure so we can change graph while pruning
-        items = copy.deepcopy([(k, v) for k, v in self.graph.items()])
+        """Replace edges in graph with an edge of flow 0, capacity of unused capacity. Saturated edges are removed.
+        Done in place: edges keep their position in the adjacency lists"""
 
-        # for every edge in the graph
-        for node, edges in items:
+        # reset unsaturated edges, and note which edges are saturated (and so need removing)
+        saturated: set[tuple[Vertex, Vertex]] = set()
+        for node, edges in self.graph.items():
             for edge in edges:
-                # self.draw("intra-settle", subdir='test_settle')
-
                 # skip residual edges
                 if edge.residual:
                     continue
 
-                # remove the edge
-                self.remove_edge(src=node, target=edge.target)
-
-                # if the edge isn't saturated add an edge back to the graph with flow=0,
-                # and capacity=old_edge.unused_capacity
                 if edge.saturated:
-                    continue
+                    saturated.add((node, edge.target))
                 else:
-                    self.add_edge(
-                        edge=Edge(edge.target, 0, edge.unused_capacity), src=node
+                    edge.capacity, edge.flow = edge.unused_capacity, 0
+
+        # remove saturated edges with their residual edges; reset the flow of residual edges that are left
+        for node, target in saturated:
+            self._incoming[target].pop(node, None)
+            self._incoming[node].pop(target, None)
+
+        for node, edges in self.graph.items():
+            if saturated:
+                edges[:] = [
+                    edge
+                    for edge in edges
+                    if (node, edge.target) not in saturated
+                    and not (edge.residual and (edge.target, node) in saturated)
+                ]
+
+            for edge in edges:
+                if edge.residual:
+                    edge.flow = 0
+
+    def edge_count(self) -> int:
+        """Returns the number of normal (non-residual) edges in the graph"""
+        return sum(not edge.residual for edges in self.graph.values() for edge in edges)
+
+    def weakly_connected_components(self) -> list[list[Vertex]]:
+        """Splits the vertices into groups with no edges between them, ignoring the direction of edges.
+        Vertices without edges are in a group of their own. Vertices keep the order they have in the graph
+        """
+        order = {v: i for i, v in enumerate(self.graph.keys())}
+        seen: set[Vertex] = set()
+        components = []
+
+        for start in self.graph.keys():
+            if start in seen:
+                continue
+
+            # residual edges point back along incoming edges, so following every edge ignores direction
+            seen.add(start)
+            component, stack = [start], [start]
+            while stack:
+                for edge in self.graph[stack.pop()]:
+                    if edge.target not in seen:
+                        seen.add(edge.target)
+                        component.append(edge.target)
+                        stack.append(edge.target)
+
+            components.append(sorted(component, key=order.__getitem__))
+
+        return components
+
+    def subgraph(self, vertices: list[Vertex]) -> FlowGraph:
+        """Returns a new graph, of the same type, with the given vertices and the normal edges between them"""
+        keep = set(vertices)
+        sub = type(self)(vertices=vertices)
+
+        for node in vertices:
+            for edge in self.graph[node]:
+                if not edge.residual and edge.target in keep:
+                    sub.add_edge(
+                        edge=Edge(edge.target, edge.flow, edge.capacity), src=node
                     )
 
+        return sub
+
+    def fingerprint(self) -> frozenset[tuple[int, int, int]]:
+        """Returns the (src id, target id, capacity) of every normal edge.
+        Cheap way to tell if two graphs hold the same debts, whatever order their edges are in
+        """
+        return frozenset(
+            (node.v_id, edge.target.v_id, edge.capacity)
+            for node, edges in self.graph.items()
+            for edge in edges
+            if not edge.residual
+        )
+
+    def pack(self) -> bytes:
+        """Returns the graph as one flat block of bytes, for caching it or sending it to another process.
+        Smaller and much quicker to write than a pickle of the vertices and edges; see _pack for the layout
+        """
+        vertices = list(self.graph.keys())
+        index = {v: i for i, v in enumerate(vertices)}
+
+        src, target, flow, capacity = array("i"), array("i"), array("q"), array("q")
+        for u, edges in self.graph.items():
+            i = index[u]
+            for edge in edges:
+                src.append(i)
+                target.append(index[edge.target])
+                flow.append(edge.flow)
+                capacity.append(edge.capacity)
+
+        return _pack(vertices, src, target, flow, capacity)
+
+    @classmethod
+    def unpack(cls, data: bytes | bytearray | memoryview) -> FlowGraph:
+        """Builds a graph from the output of pack. data can be any bytes-like object, e.g. SharedMemory.buf"""
+        vertices, src, target, flow, capacity = _unpack(data)
+
+        graph: dict[Vertex, list[Edge]] = {v: [] for v in vertices}
+        for u, v, f, c in zip(src, target, flow, capacity):
+            graph[vertices[u]].append(Edge(vertices[v], f, c))
+
+        return cls(graph=graph)
+
     def draw(self, filename="out", *, subdir="", res=True):
+        """Prints the DOT source of the graph and renders it to an SVG under renders/"""
+        dot = self.dot(res=res)
+
+        print(dot.source)
+        dot.render(
+            filename=f"{filename}",
+            directory=f"{getcwd()}/renders{'/' + subdir if subdir else ''}",
+            format="svg",
+        )
+
+    def dot(self, *, res=True) -> graphviz.Digraph:
+        """Returns the graph in DOT form. Doesn't render anything, so graphviz itself isn't run"""
         dot = graphviz.Digraph(comment="Flow Graph")
 
         # create nodes
@@ -271,9 +540,394 @@ class FlowGraph:
                         fontcolor="red",
                     )
 
-        print(dot.source)
-        dot.render(
-            filename=f"{filename}",
-            directory=f"{getcwd()}/renders{'/' + subdir if subdir else ''}",
-            format="svg",
+        return dot
+
+
+class AdjacencyView(Mapping):
+    """Read-only mapping of vertices to their edges for a CompactFlowGraph.
+
+    Looks like FlowGraph.graph, but edge lists are built on demand, so iterating over the vertices is cheap.
+    Edges returned are copies; changing them does not change the graph
+    """
+
+    def __init__(self, compact: CompactFlowGraph):
+        self._compact = compact
+
+    def __getitem__(self, v: Vertex) -> list[Edge]:
+        return self._compact.edges(v)
+
+    def __iter__(self) -> Iterator[Vertex]:
+        return iter(self._compact.index)
+
+    def __contains__(self, v: object) -> bool:
+        return v in self._compact.index
+
+    def __len__(self) -> int:
+        return len(self._compact.index)
+
+
+class CompactFlowGraph(FlowGraph):
+    """Flow graph stored in flat arrays, with the same public API as FlowGraph.
+
+    Every vertex is given a dense integer index. Edges are stored in pairs: edge e is the normal edge and e ^ 1 is
+    its residual edge. The target, flow and capacity of edge e live at position e of the flat arrays.
+    For every vertex we keep a dict of target index -> edge id, which gives an O(1) lookup of the edge (u, v)
+    and keeps the edges in the order they were added.
+
+    ASSUMPTION: same as FlowGraph, no two-way edges. This means (u, v) maps to at most one edge
+    """
+
+    def __init__(self, vertices: list[Vertex] = None, graph: dict[Vertex, list[Edge]] = None):  # type: ignore
+        # vertex table; removed vertices leave a None behind so indices stay stable
+        self.vertices: list[Vertex | None] = []
+        self.index: dict[Vertex, int] = {}
+
+        # adjacency: vertex index -> {target index: edge id}
+        self._adj: list[dict[int, int]] = []
+
+        # flat edge arrays, indexed by edge id
+        self._target: list[int] = []
+        self._flow: list[int] = []
+        self._capacity: list[int] = []
+
+        # edge pairs which have been removed and can be reused
+        self._free: list[int] = []
+
+        if graph is None:
+            for v in vertices or []:
+                self.add_vertex(v)
+            return
+
+        for v in graph.keys():
+            self.add_vertex(v)
+
+        # add normal edges (which also creates their residual edges) ...
+        for u, edges in graph.items():
+            for edge in edges:
+                if not edge.residual:
+                    self.add_edge(
+                        edge=Edge(edge.target, edge.flow, edge.capacity), src=u
+                    )
+
+        # ... then copy over the flow of the residual edges
+        for u, edges in graph.items():
+            for edge in edges:
+                if edge.residual and (e := self._edge_id(u, edge.target)) is not None:
+                    self._flow[e] = edge.flow
+
+    @classmethod
+    def from_netted(
+        cls,
+        vertices: list[Vertex],
+        src: Sequence[int],
+        target: Sequence[int],
+        capacity: Sequence[int],
+    ) -> CompactFlowGraph:
+        """Builds a graph straight into the flat arrays from debts which are already netted: edge i goes from
+        vertices[src[i]] to vertices[target[i]], and no two edges join the same two vertices. Skips the per-edge
+        checks of add_edge, so it is much cheaper than from_debts for large graphs"""
+        graph = cls(vertices=vertices)
+
+        graph._target = [i for pair in zip(target, src) for i in pair]
+        graph._capacity = [c for pair in zip(capacity, repeat(0)) for c in pair]
+        graph._flow = [0] * len(graph._target)
+
+        for e, (u, v) in enumerate(zip(src, target)):
+            graph._adj[u][v] = 2 * e
+            graph._adj[v][u] = 2 * e + 1
+
+        return graph
+
+    def pack(self) -> bytes:
+        """Returns the graph as one flat block of bytes; see FlowGraph.pack. Read straight from the edge arrays"""
+        vertices = [v for v in self.vertices if v is not None]
+        adj = [self._adj[self.index[v]] for v in vertices]
+
+        # removed vertices leave gaps in the vertex table, which the packed graph doesn't have
+        position = list(range(len(self.vertices)))
+        if len(vertices) < len(self.vertices):
+            position = [-1] * len(self.vertices)
+            for i, v in enumerate(vertices):
+                position[self.index[v]] = i
+
+        edge_ids = [e for a in adj for e in a.values()]
+
+        return _pack(
+            vertices,
+            array("i", [i for i, a in enumerate(adj) for _ in range(len(a))]),
+            array("i", [position[t] for a in adj for t in a]),
+            array("q", map(self._flow.__getitem__, edge_ids)),
+            array("q", map(self._capacity.__getitem__, edge_ids)),
+        )
+
+    @classmethod
+    def unpack(cls, data: bytes | bytearray | memoryview) -> CompactFlowGraph:
+        """Builds a graph from the output of pack straight into the edge arrays, with no Edge objects in between"""
+        vertices, src, target, flow, capacity = _unpack(data)
+        graph = cls(vertices=vertices)
+
+        # an edge and its residual edge share a pair of slots: normal edges are given the first slot of a new pair,
+        # then residual edges take the second slot of the pair going the other way
+        normal = [k for k, c in enumerate(capacity) if c]
+        slot = [0] * len(src)
+        pair: dict[tuple[int, int], int] = {}
+        for e, k in enumerate(normal):
+            slot[k] = 2 * e
+            pair[(target[k], src[k])] = 2 * e + 1
+
+        for k, c in enumerate(capacity):
+            if not c:
+                slot[k] = pair[(src[k], target[k])]
+
+        graph._target = [0] * (2 * len(normal))
+        graph._flow = [0] * len(graph._target)
+        graph._capacity = [0] * len(graph._target)
+        for k, e in enumerate(slot):
+            u, v = src[k], target[k]
+            graph._target[e], graph._flow[e], graph._capacity[e] = (
+                v,
+                flow[k],
+                capacity[k],
+            )
+            graph._target[e ^ 1] = u
+            graph._adj[u][v] = e
+
+        return graph
+
+    @staticmethod
+    def from_flow_graph(graph: FlowGraph) -> CompactFlowGraph:
+        """Builds a compact copy of any flow graph"""
+        return CompactFlowGraph(graph=dict(graph.graph.items()))
+
+    @property
+    def graph(self) -> AdjacencyView:  # type: ignore
+        return AdjacencyView(self)
+
+    def edges(self, v: Vertex) -> list[Edge]:
+        """Returns copies of the edges leaving v, residual edges included"""
+        return [
+            Edge(self.vertices[t], self._flow[e], self._capacity[e])  # type: ignore
+            for t, e in self._adj[self.index[v]].items()
+        ]
+
+    def _edge_id(self, u: Vertex, v: Vertex, residual: bool = True) -> int | None:
+        """Returns the id of the edge u -> v, or None if there isn't one"""
+        try:
+            e = self._adj[self.index[u]].get(self.index[v])
+        except KeyError:
+            return None
+
+        if e is None or (not residual and not self._capacity[e]):
+            return None
+
+        return e
+
+    def _push(self, e: int, flow: int):
+        """Pushes flow down the edge with id e"""
+        unused = self._capacity[e] - self._flow[e]
+        if flow > unused:
+            raise OverFlowError(
+                f"Tried to push {flow} units down an edge with an unused capacity of {unused}"
+            )
+
+        self._flow[e] += flow
+
+    def intern(self, v: Vertex) -> Vertex:
+        """Returns the graph's own vertex equal to v, or v if the graph doesn't have it.
+        The vertex table is the intern table here"""
+        i = self.index.get(v)
+        return v if i is None else self.vertices[i]  # type: ignore
+
+    def add_vertex(self, v: Vertex):
+        """Adds a vertex with no edges to the graph"""
+        if v in self.index:
+            self._adj[self.index[v]] = {}
+            return
+
+        self.index[v] = len(self.vertices)
+        self.vertices.append(v)
+        self._adj.append({})
+
+    def augment_flow(self, path: list[Vertex], flow: int):
+        for u, v in zip(path, path[1:]):
+            if (e := self._edge_id(u, v)) is not None:
+                self._push(e, flow)
+
+            if (e := self._edge_id(v, u)) is not None:
+                self._push(e, -1 * flow)
+
+    def remove_vertex(self, v: Vertex):
+        """Removes a vertex, and all of its incoming / outgoing edges from a graph"""
+        i = self.index[v]
+
+        # every edge touching v is either in v's adjacency, or has its residual edge there
+        for t in list(self._adj[i]):
+            target = self.vertices[t]
+            if self._edge_id(v, target, residual=False) is not None:  # type: ignore
+                self.remove_edge(src=v, target=target)  # type: ignore
+            elif self._edge_id(target, v, residual=False) is not None:  # type: ignore
+                self.remove_edge(src=target, target=v)  # type: ignore
+
+        # drop anything left over (e.g. edges added without a residual edge)
+        for t in self._adj[i]:
+            self._adj[t].pop(i, None)
+
+        self._adj[i] = {}
+        self.vertices[i] = None
+        self.index.pop(v)
+
+    def add_edge(self, *, edge: Edge, src: Vertex, add_residual=True):
+        """Adds an edge to the flow graph from a given vertex. Will also add the residual edge by default"""
+
+        # if we add an edge going opposite the edge that already exists throw an error
+        # this should be cleaned **before**
+        if self._edge_id(edge.target, src, residual=False) is not None:
+            raise FlowGraphError("Edge going in two directions")
+
+        # merge with the edge if it already exists
+        if (e := self._edge_id(src, edge.target, residual=False)) is not None:
+            flow, capacity = self._flow[e], self._capacity[e]
+            self.remove_edge(src=src, target=edge.target)
+            self.add_edge(
+                src=src,
+                edge=Edge(edge.target, edge.flow + flow, edge.capacity + capacity),
+            )
+            return
+
+        u, v = self.index[src], self.index[edge.target]
+
+        # reuse the slots of a removed edge pair where we can
+        if self._free:
+            e = self._free.pop()
+            self._target[e], self._flow[e], self._capacity[e] = (
+                v,
+                edge.flow,
+                edge.capacity,
+            )
+            self._target[e ^ 1], self._flow[e ^ 1], self._capacity[e ^ 1] = u, 0, 0
+        else:
+            e = len(self._target)
+            self._target += [v, u]
+            self._flow += [edge.flow, 0]
+            self._capacity += [edge.capacity, 0]
+
+        self._adj[u][v] = e
+        if add_residual:
+            self._adj[v][u] = e ^ 1
+
+    def remove_edge(self, *, src: Vertex, target: Vertex):
+        """Removes an edge given it exists. Can only remove edges that exist. Residual edges removed automatically"""
+        if (e := self._edge_id(src, target, residual=False)) is None:
+            raise FlowGraphError(
+                "Tried to delete edge which doesn't exist - maybe you are trying to delete a "
+                "residual edge?"
+            )
+
+        u, v = self.index[src], self.index[target]
+        self._adj[u].pop(v)
+        self._adj[v].pop(u, None)
+        self._free.append(e & ~1)
+
+    def neighbours(self, current: Vertex) -> list[Vertex]:
+        """Returns the neighbours of the current node
+        All nodes which can be accessed by an edge (residual or not) will be
+        """
+        return [
+            self.vertices[t]  # type: ignore
+            for t, e in self._adj[self.index[current]].items()
+            if self._capacity[e] != self._flow[e]
+        ]
+
+    def open_edges(self, current: Vertex) -> list[tuple[Vertex, int]]:
+        """Returns (neighbour, unused capacity) for every edge out of current with capacity left, residual or not"""
+        flows, capacities, vertices = self._flow, self._capacity, self.vertices
+        return [
+            (vertices[t], capacities[e] - flows[e])  # type: ignore
+            for t, e in self._adj[self.index[current]].items()
+            if capacities[e] > flows[e]
+        ]
+
+    def unused_capacity(self, u: Vertex, v: Vertex, residual: bool = False) -> int:
+        """Returns the unused capacity of an edge between two nodes. If there is no edge between the nodes return -1."""
+        if (e := self._edge_id(u, v, residual)) is None:
+            return -1
+
+        return self._capacity[e] - self._flow[e]
+
+    def get_edge(self, u: Vertex, v: Vertex, residual=False) -> Edge:
+        """Returns a copy of the edge between a src and a target node. Will return residual edges by default.
+        Will raise an EdgeNotFound error if there is no edge between u and v"""
+        if (e := self._edge_id(u, v, residual)) is None:
+            raise EdgeNotFoundError
+
+        return Edge(v, self._flow[e], self._capacity[e])
+
+    def operate_on_edge(self, u: Vertex, v: Vertex, fn: Callable, *args, **kwargs):
+        """Calls fn on the edge u -> v and writes any change to its flow or capacity back to the graph"""
+        if (e := self._edge_id(u, v)) is None:
+            return
+
+        edge = Edge(v, self._flow[e], self._capacity[e])
+        fn(edge, *args, **kwargs)
+        self._flow[e], self._capacity[e] = edge.flow, edge.capacity
+
+    def prune_edges(self):
+        """Replace edges in graph with an edge of flow 0, capacity of unused capacity. Saturated edges are removed.
+        Done in place: edges keep their position in the adjacency lists"""
+        flows, capacities = self._flow, self._capacity
+
+        for u, adj in enumerate(self._adj):
+            saturated = []
+            for t, e in adj.items():
+                # skip residual edges
+                if not capacities[e]:
+                    continue
+
+                if capacities[e] == flows[e]:
+                    saturated.append(t)
+                else:
+                    capacities[e] -= flows[e]
+                    flows[e] = flows[e ^ 1] = 0
+
+            for t in saturated:
+                e = adj.pop(t)
+                self._adj[t].pop(u, None)
+                self._free.append(e & ~1)
+
+    def edge_count(self) -> int:
+        """Returns the number of normal (non-residual) edges in the graph"""
+        return sum(bool(self._capacity[e]) for adj in self._adj for e in adj.values())
+
+    def weakly_connected_components(self) -> list[list[Vertex]]:
+        """Splits the vertices into groups with no edges between them, ignoring the direction of edges"""
+        # indices are handed out in the order vertices are added, so sorting them keeps the graph's order
+        seen = [False] * len(self.vertices)
+        components = []
+
+        for start in self.index.values():
+            if seen[start]:
+                continue
+
+            seen[start] = True
+            component, stack = [start], [start]
+            while stack:
+                for t in self._adj[stack.pop()]:
+                    if not seen[t]:
+                        seen[t] = True
+                        component.append(t)
+                        stack.append(t)
+
+            components.append(
+                [v for i in sorted(component) if (v := self.vertices[i]) is not None]
+            )
+
+        return components
+
+    def fingerprint(self) -> frozenset[tuple[int, int, int]]:
+        """Returns the (src id, target id, capacity) of every normal edge"""
+        return frozenset(
+            (self.vertices[u].v_id, self.vertices[t].v_id, self._capacity[e])  # type: ignore
+            for u, adj in enumerate(self._adj)
+            for t, e in adj.items()
+            if self._capacity[e]
         )
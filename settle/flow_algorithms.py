@@ -1,4 +1,12 @@
-import copy
+from __future__ import annotations
+
+import heapq
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+from typing import Callable
 
 import settle.flow as flow
 
@@ -11,25 +19,354 @@ class NoSimplification(Exception):
     ...
 
 
+class EngineNotFound(Exception):
+    ...
+
+
+class UnbalancedDebts(Exception):
+    ...
+
+
+@dataclass
+class Counters:
+    """How much work max flow and simplification did. Only collected when asked for, by passing a Counters to fill
+    in (stats=...) or registering a hook (see add_stats_hook); otherwise nothing is counted
+    """
+
+    # breadth first searches, and the vertices and edges (with capacity left) they looked at
+    bfs_runs: int = 0
+    vertices_dequeued: int = 0
+    edges_scanned: int = 0
+
+    # flow pushed along a path (or, for push-relabel, along an edge)
+    augmentations: int = 0
+
+    prune_edges_calls: int = 0
+
+    def add(self, other: Counters):
+        """Adds other's counts to these"""
+        self.bfs_runs += other.bfs_runs
+        self.vertices_dequeued += other.vertices_dequeued
+        self.edges_scanned += other.edges_scanned
+        self.augmentations += other.augmentations
+        self.prune_edges_calls += other.prune_edges_calls
+
+
+class Budget:
+    """Limits how long Settle.simplify may run for, in seconds and/or in max flow runs. Once either runs out, the
+    best simplification found so far is returned and marked as partial. The clock starts when the budget is made.
+
+    Checked between max flow runs. Groups simplified in other processes each count their own max flow runs
+    """
+
+    def __init__(self, seconds: float | None = None, max_flows: int | None = None):
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.max_flows = max_flows
+        self.flows = 0
+        self.ran_out = False
+
+    def spent(self) -> bool:
+        """Returns whether the budget has run out. Once it has, it stays run out"""
+        if not self.ran_out:
+            self.ran_out = (
+                self.max_flows is not None and self.flows >= self.max_flows
+            ) or (self.deadline is not None and time.monotonic() >= self.deadline)
+
+        return self.ran_out
+
+
+# called with the counters of every Settle.simplify; see add_stats_hook
+stats_hooks: list[Callable[[Counters], None]] = []
+
+
+def add_stats_hook(hook: Callable[[Counters], None]):
+    """Calls hook with the counters of every simplification from now on, e.g. to send them to a metrics system.
+    Counting is switched on while any hook is registered"""
+    stats_hooks.append(hook)
+
+
+def remove_stats_hook(hook: Callable[[Counters], None]):
+    stats_hooks.remove(hook)
+
+
+@dataclass
+class FlowResult:
+    """Result of running a max flow engine between two vertices"""
+
+    value: int
+    engine: str
+
+    # work done, if counters were asked for
+    stats: Counters | None = None
+
+
+class PathSearch:
+    """Breadth first search for augmenting paths, with buffers that are kept between searches of the same graph.
+
+    Rather than clearing visited / parent maps over every vertex for each search, a vertex counts as visited if its
+    stamp matches the current search's. The search stops as soon as it reaches the sink, and works out the path's
+    bottleneck as it goes, so each augmentation costs one partial pass over the graph
+    """
+
+    def __init__(self, graph: flow.FlowGraph):
+        self.graph = graph
+
+        # search number; vertex -> number of the last search to reach it
+        self._stamp = 0
+        self._seen: dict[flow.Vertex, int] = {v: 0 for v in graph.graph.keys()}
+
+        # vertex -> vertex it was reached from, and the smallest unused capacity on the way there
+        self._parent: dict[flow.Vertex, flow.Vertex] = {}
+        self._reach: dict[flow.Vertex, int] = {}
+
+        self._queue: deque[flow.Vertex] = deque()
+
+    def shortest_path(
+        self, src: flow.Vertex, sink: flow.Vertex, stats: Counters | None = None
+    ) -> tuple[list[flow.Vertex], int]:
+        """Returns the shortest path from src to sink through edges with unused capacity, and its bottleneck.
+        Returns ([], 0) if there is no such path"""
+        self._stamp += 1
+        stamp, seen, parent, reach = self._stamp, self._seen, self._parent, self._reach
+        open_edges = self.graph.open_edges
+
+        queue = self._queue
+        queue.clear()
+        queue.append(src)
+        seen[src] = stamp
+        reach[src] = 0
+        if stats is not None:
+            stats.bfs_runs += 1
+
+        while queue:
+            current = queue.popleft()
+            edges = open_edges(current)
+            if stats is not None:
+                stats.vertices_dequeued += 1
+                stats.edges_scanned += len(edges)
+
+            for neighbour, unused in edges:
+                if seen.get(neighbour) == stamp:
+                    continue
+
+                seen[neighbour] = stamp
+                parent[neighbour] = current
+                reach[neighbour] = (
+                    unused
+                    if current is src or unused < reach[current]
+                    else reach[current]
+                )
+
+                if neighbour == sink:
+                    return self._path(src, sink), reach[sink]
+
+                queue.append(neighbour)
+
+        return [], 0
+
+    def _path(self, src: flow.Vertex, sink: flow.Vertex) -> list[flow.Vertex]:
+        path = [sink]
+        while path[-1] != src:
+            path.append(self._parent[path[-1]])
+        path.reverse()
+        return path
+
+
 class MaxFlow:
     @staticmethod
-    def edmunds_karp(graph: flow.FlowGraph, src: flow.Vertex, sink: flow.Vertex) -> int:
+    def run(
+        graph: flow.FlowGraph,
+        src: flow.Vertex,
+        sink: flow.Vertex,
+        engine: str = "edmonds_karp",
+        stats: Counters | None = None,
+    ) -> FlowResult:
+        """Runs the max flow engine with the given name between src and sink.
+        Engines: 'edmonds_karp', 'dinic' and 'push_relabel'; all give the same max flow value.
+        Work done is added to stats, if given"""
+        try:
+            fn = ENGINES[engine]
+        except KeyError:
+            raise EngineNotFound(f"No max flow engine called '{engine}'")
+
+        return FlowResult(fn(graph, src, sink, stats), engine, stats)
+
+    @staticmethod
+    def edmunds_karp(
+        graph: flow.FlowGraph,
+        src: flow.Vertex,
+        sink: flow.Vertex,
+        stats: Counters | None = None,
+    ) -> int:
         """Returns the max flow between src and sink nodes"""
         max_flow = 0
-        while aug_path := MaxFlow.augmenting_path(graph, src, sink):
-            bottleneck = MaxFlow.bottleneck(graph, aug_path)
+        search = PathSearch(graph)
+
+        while True:
+            aug_path, bottleneck = search.shortest_path(src, sink, stats)
+            if not aug_path:
+                break
+
             max_flow += bottleneck
             graph.augment_flow(aug_path, bottleneck)
+            if stats is not None:
+                stats.augmentations += 1
             # graph.draw(f"intra-settle", subdir='test_settle')
 
         return max_flow
 
+    @staticmethod
+    def dinic(
+        graph: flow.FlowGraph,
+        src: flow.Vertex,
+        sink: flow.Vertex,
+        stats: Counters | None = None,
+    ) -> int:
+        """Returns the max flow between src and sink nodes using Dinic's algorithm.
+
+        Builds a level graph with a bfs, then pushes a blocking flow through it with a dfs. Every vertex keeps a
+        pointer to the next edge to try, so dead ends are never explored twice in the same phase
+        """
+        max_flow = 0
+        while level := MaxFlow._levels(graph, src, sink, stats):
+            # edges of the level graph; only edges going one level deeper are kept
+            arcs = {
+                u: [v for v in graph.neighbours(u) if level.get(v) == level[u] + 1]
+                for u in level
+            }
+            pointer = {u: 0 for u in level}
+
+            # iterative dfs from src; path holds the vertices from src to the current vertex
+            path = [src]
+            while path:
+                current = path[-1]
+
+                if current == sink:
+                    bottleneck = MaxFlow.bottleneck(graph, path)
+                    graph.augment_flow(path, bottleneck)
+                    max_flow += bottleneck
+                    path = [src]
+                    if stats is not None:
+                        stats.augmentations += 1
+                    continue
+
+                # advance along the next edge with unused capacity
+                while pointer[current] < len(arcs[current]):
+                    nxt = arcs[current][pointer[current]]
+                    if graph.unused_capacity(current, nxt, residual=True) > 0:
+                        path.append(nxt)
+                        break
+                    pointer[current] += 1
+
+                # dead end: retreat, and skip the edge leading here next time
+                else:
+                    path.pop()
+                    if path:
+                        pointer[path[-1]] += 1
+
+        return max_flow
+
+    @staticmethod
+    def push_relabel(
+        graph: flow.FlowGraph,
+        src: flow.Vertex,
+        sink: flow.Vertex,
+        stats: Counters | None = None,
+    ) -> int:
+        """Returns the max flow between src and sink nodes using the FIFO push-relabel algorithm.
+
+        Saturates every edge out of src, then repeatedly discharges active vertices (vertices with excess flow) in
+        first-in first-out order. Excess that can't reach the sink is pushed back to src, so the graph is left with a
+        valid max flow, the same as the other engines. Discharging a vertex counts as dequeuing it, and every push
+        as an augmentation
+        """
+        vertices = [v for v in graph.graph.keys()]
+
+        height = {v: 0 for v in vertices}
+        excess = {v: 0 for v in vertices}
+        height[src] = len(vertices)
+
+        # saturate all edges going out of src
+        for v in graph.neighbours(src):
+            cap = graph.unused_capacity(src, v, residual=True)
+            graph.augment_flow([src, v], cap)
+            excess[v] += cap
+            excess[src] -= cap
+
+        active = deque(v for v in vertices if excess[v] and v != src and v != sink)
+
+        while active:
+            u = active.popleft()
+            if stats is not None:
+                stats.vertices_dequeued += 1
+
+            # discharge u: push to lower neighbours, relabel when stuck
+            while excess[u]:
+                neighbours = graph.neighbours(u)
+                if stats is not None:
+                    stats.edges_scanned += len(neighbours)
+
+                for v in neighbours:
+                    if height[u] != height[v] + 1:
+                        continue
+
+                    pushed = min(excess[u], graph.unused_capacity(u, v, residual=True))
+                    graph.augment_flow([u, v], pushed)
+                    if stats is not None:
+                        stats.augmentations += 1
+
+                    # v becomes active if it had no excess before this push
+                    if excess[v] == 0 and v != src and v != sink:
+                        active.append(v)
+
+                    excess[u] -= pushed
+                    excess[v] += pushed
+
+                    if not excess[u]:
+                        break
+
+                else:
+                    height[u] = 1 + min(height[v] for v in graph.neighbours(u))
+
+        return excess[sink]
+
+    @staticmethod
+    def _levels(
+        graph: flow.FlowGraph,
+        src: flow.Vertex,
+        sink: flow.Vertex,
+        stats: Counters | None = None,
+    ) -> dict[flow.Vertex, int]:
+        """Returns the bfs distance from src of every vertex reachable through edges with unused capacity.
+        Returns an empty map if sink can't be reached"""
+        level = {src: 0}
+        queue = deque([src])
+        if stats is not None:
+            stats.bfs_runs += 1
+
+        while queue:
+            current = queue.popleft()
+            neighbours = graph.neighbours(current)
+            if stats is not None:
+                stats.vertices_dequeued += 1
+                stats.edges_scanned += len(neighbours)
+
+            for neighbour in neighbours:
+                if neighbour not in level:
+                    level[neighbour] = level[current] + 1
+                    queue.append(neighbour)
+
+        return level if sink in level else {}
+
     @staticmethod
     def augmenting_path(
-        graph: flow.FlowGraph, src: flow.Vertex, sink: flow.Vertex
+        graph: flow.FlowGraph,
+        src: flow.Vertex,
+        sink: flow.Vertex,
+        stats: Counters | None = None,
     ) -> list[flow.Vertex]:
-        """Returns the shortest path from src -> sink"""
-        return MaxFlow._bfs(graph, src=src, sink=sink)
+        """Returns the shortest path from src -> sink. See PathSearch to find several paths in the same graph"""
+        return PathSearch(graph).shortest_path(src, sink, stats)[0]
 
     @staticmethod
     def bottleneck(graph: flow.FlowGraph, path: list[flow.Vertex]) -> int:
@@ -44,84 +381,254 @@ class MaxFlow:
             )
         )
 
+
+# max flow engines, by name
+ENGINES: dict[
+    str, Callable[[flow.FlowGraph, flow.Vertex, flow.Vertex, Counters | None], int]
+] = {
+    "edmonds_karp": MaxFlow.edmunds_karp,
+    "dinic": MaxFlow.dinic,
+    "push_relabel": MaxFlow.push_relabel,
+}
+
+
+# components need at least this many edges before they are worth sending to another process
+PARALLEL_MIN_EDGES = 200
+
+
+@dataclass
+class Settlement:
+    """Result of simplifying a debt network"""
+
+    graph: flow.FlowGraph
+
+    # total debt removed by cancelling cycles before running max flow
+    cancelled: int = 0
+
+    # work done, if counters were asked for
+    stats: Counters | None = None
+
+    # the budget ran out before the whole network was simplified
+    partial: bool = False
+
+
+class Settle:
     @staticmethod
-    def _bfs(
-        graph: flow.FlowGraph, src: flow.Vertex, sink: flow.Vertex
-    ) -> list[flow.Vertex]:
-        """performs a bfs starting from a src node to a sink node; reconstructs the shortest path
-        (in terms of edges traversed) from src to sink and returns it."""
+    def simplify_debt(
+        debt_network: flow.FlowGraph,
+        engine: str = "edmonds_karp",
+        workers: int | None = None,
+        cancel_cycles: bool = False,
+        stats: Counters | None = None,
+        budget: Budget | None = None,
+    ) -> flow.FlowGraph:
+        """Returns the debt network, simplified, in graph form. See Settle.simplify"""
+        return Settle.simplify(
+            debt_network, engine, workers, cancel_cycles, stats, budget
+        ).graph
+
+    @staticmethod
+    def simplify(
+        debt_network: flow.FlowGraph,
+        engine: str = "edmonds_karp",
+        workers: int | None = None,
+        cancel_cycles: bool = False,
+        stats: Counters | None = None,
+        budget: Budget | None = None,
+    ) -> Settlement:
+        """Simplifies the debt network. Raises NoSimplification if the simplified network is the same as the original.
+        engine is the name of the max flow engine to use (see MaxFlow.run)
+
+        With cancel_cycles set, debts going round in cycles are cancelled first (see Settle.cancel_cycles).
+
+        The network is then split into groups of people who have no debts between them (weakly connected
+        components). Each group is simplified on its own; when there are several groups with at least
+        PARALLEL_MIN_EDGES edges, they are simplified in a pool of processes. workers limits the size of the pool
+        (defaults to the number of CPUs); workers=1 never starts a pool.
+
+        Work done is counted into stats, if given, or into new Counters if a stats hook is registered. The counters
+        are returned on the Settlement and passed to every hook, even when NoSimplification is raised.
+
+        With a budget, simplification stops when the budget runs out. Debts not simplified yet are added to the
+        ones that have been, netting any between the same two people, so the result still settles the same
+        balances; the Settlement is marked partial.
+        """
+        if stats is None and stats_hooks:
+            stats = Counters()
 
-        # store vertices of the graph
-        vertices = graph.graph.keys()
+        # fingerprint of the debts we started with, to tell if anything changed
+        debt_fingerprint = debt_network.fingerprint()
 
-        # initialise the visited map with all nodes set to false
-        visited: dict[flow.Vertex, bool] = {v: False for v in vertices}
+        cancelled = Settle.cancel_cycles(debt_network) if cancel_cycles else 0
 
-        # initialise the came_from map with all nodes set to None
-        came_from: dict[flow.Vertex, flow.Vertex | None] = {v: None for v in vertices}
+        components = [
+            c for c in debt_network.weakly_connected_components() if len(c) > 1
+        ]
 
-        # initialise the queue; enqueue src node
-        queue: list[flow.Vertex] = [src]
+        if len(components) <= 1:
+            simplified_debt = Settle._simplify_component(
+                debt_network, engine, stats, budget
+            )
+        else:
+            simplified_debt = Settle._simplify_components(
+                debt_network, components, engine, workers, stats, budget
+            )
 
-        while queue:
-            # dequeue into current; mark current as visited
-            current = queue.pop(0)
-            visited[current] = True
-
-            # if neighbours haven't been visited, enqueue them and mark them as coming from current
-            for neighbour in graph.neighbours(current):
-                # move on if we have already visited the neighbour
-                if visited[neighbour]:
+        if stats is not None:
+            for hook in stats_hooks:
+                hook(stats)
+
+        if simplified_debt.fingerprint() == debt_fingerprint:
+            raise NoSimplification("No simplifications were made")
+
+        return Settlement(
+            simplified_debt, cancelled, stats, budget is not None and budget.ran_out
+        )
+
+    @staticmethod
+    def cancel_cycles(debt_network: flow.FlowGraph) -> int:
+        """Cancels debts which go round in cycles, in place. e.g. A owes B 5, B owes C 10, C owes A 5 leaves
+        B owes C 5. Returns the total debt removed from the network.
+
+        Uses a dfs over the normal edges. Finding an edge back to a vertex on the dfs stack means there is a cycle;
+        the smallest debt in the cycle is taken off every edge of the cycle, removing at least one edge. The dfs
+        then carries on from just before the first removed edge, so every edge is looked at a bounded number of
+        times rather than restarting the search for every cycle
+        """
+        cancelled = 0
+
+        # dfs state: vertices on the stack, vertices whose every path has been explored, out edges to try
+        on_stack: dict[flow.Vertex, int] = {}
+        done: set[flow.Vertex] = set()
+        targets: dict[flow.Vertex, list[flow.Vertex]] = {}
+        pointer: dict[flow.Vertex, int] = {}
+
+        for start in debt_network.graph.keys():
+            if start in done:
+                continue
+
+            stack = [start]
+            on_stack[start] = 0
+
+            while stack:
+                current = stack[-1]
+
+                if current not in targets:
+                    targets[current] = [
+                        e.target for e in debt_network.graph[current] if not e.residual
+                    ]
+                    pointer[current] = 0
+
+                # no edges left to try; every path from current is explored
+                if pointer[current] == len(targets[current]):
+                    done.add(stack.pop())
+                    on_stack.pop(current)
                     continue
 
-                # otherwise enqueue
-                queue.append(neighbour)
+                nxt = targets[current][pointer[current]]
 
-                # and mark as coming from current node
-                came_from[neighbour] = current
+                # edge has been cancelled out, or leads somewhere with no cycles
+                if debt_network.unused_capacity(current, nxt) <= 0 or nxt in done:
+                    pointer[current] += 1
+                    continue
 
-                # can exit early if we have just processed the sink node
-                if neighbour == sink:
-                    break
+                # not seen yet; go deeper
+                if nxt not in on_stack:
+                    on_stack[nxt] = len(stack)
+                    stack.append(nxt)
+                    continue
 
-        return MaxFlow._path_from_map(came_from, src=src, sink=sink)
+                # back edge: cycle is stack[on_stack[nxt]:] -> nxt
+                cycle = stack[on_stack[nxt] :] + [nxt]
+                edges = list(zip(cycle, cycle[1:]))
+                smallest = min(debt_network.unused_capacity(u, v) for u, v in edges)
 
-    @staticmethod
-    def _path_from_map(
-        came_from: dict[flow.Vertex, flow.Vertex | None],
-        *,
-        src: flow.Vertex,
-        sink: flow.Vertex,
-    ) -> list[flow.Vertex]:
-        """Builds a path of vertices from the map generated by the bfs"""
+                for u, v in edges:
+                    if debt_network.unused_capacity(u, v) == smallest:
+                        debt_network.remove_edge(src=u, target=v)
+                    else:
+                        debt_network.operate_on_edge(u, v, _reduce_capacity, smallest)
 
-        # if nothing has been changed then return an empty list, as no more paths exist
-        if list(came_from.values()).count(None) == len(came_from.values()):
-            return []
+                cancelled += smallest * len(edges)
 
-        # raise an error if we don't have a pointer to sink, as no path was found that leads to the sink
-        if came_from[sink] is None:
-            return []
+                # go back to the first vertex whose edge in the cycle was removed; vertices above it are no longer
+                # on a path from start so they are taken off the stack (their edge pointers are kept)
+                first = next(
+                    i
+                    for i, (u, v) in enumerate(edges)
+                    if debt_network.unused_capacity(u, v) == -1
+                )
+                for v in stack[on_stack[nxt] + first + 1 :]:
+                    on_stack.pop(v)
+                del stack[on_stack[nxt] + first + 1 :]
 
-        # build path backtracking from sink
-        path: list[flow.Vertex] = [sink]
+        return cancelled
 
-        current: flow.Vertex = sink
-        while current := came_from[current]:
-            # add vertex to front of path if the map doesn't correspond to None
-            path.insert(0, current) if current else 0
+    @staticmethod
+    def _simplify_components(
+        debt_network: flow.FlowGraph,
+        components: list[list[flow.Vertex]],
+        engine: str,
+        workers: int | None,
+        stats: Counters | None = None,
+        budget: Budget | None = None,
+    ) -> flow.FlowGraph:
+        """Simplifies each component of the debt network on its own and merges the results"""
+        parts = [debt_network.subgraph(c) for c in components]
+        large = [p for p in parts if p.edge_count() >= PARALLEL_MIN_EDGES]
+        count = stats is not None
+
+        if workers != 1 and len(large) > 1:
+            # FlowGraphs go to the workers packed, which is much cheaper than pickling every vertex and edge. A
+            # CompactFlowGraph already pickles as flat lists of ints, which is smaller still, so it is sent as it is
+            packed = [
+                p if isinstance(p, flow.CompactFlowGraph) else p.pack() for p in parts
+            ]
+
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = [
+                    (flow.FlowGraph.unpack(simplified), part_stats, ran_out)
+                    for simplified, part_stats, ran_out in pool.map(
+                        _simplify_packed,
+                        packed,
+                        repeat(engine),
+                        repeat(count),
+                        repeat(budget),
+                    )
+                ]
+        else:
+            results = [_simplify_part(p, engine, count, budget) for p in parts]
 
-        # Throw an error if start isn't source or end isn't sink - means the path is broken
-        if path[0] != src or path[-1] != sink:
-            raise PathError("Broken path: could not generate a path from src -> sink")
+        # merge the groups back into one graph
+        simplified_debt = flow.FlowGraph(
+            vertices=[v for v in debt_network.graph.keys()]
+        )
+        for simplified, part_stats, ran_out in results:
+            if stats is not None and part_stats is not None:
+                stats.add(part_stats)
 
-        return path
+            # workers ran out of their copy of the budget
+            if budget is not None and ran_out:
+                budget.ran_out = True
 
+            for src, edges in simplified.graph.items():
+                for edge in edges:
+                    if not edge.residual:
+                        simplified_debt.add_edge(
+                            edge=flow.Edge(edge.target, 0, edge.capacity), src=src
+                        )
+
+        return simplified_debt
 
-class Settle:
     @staticmethod
-    def simplify_debt(debt_network: flow.FlowGraph) -> flow.FlowGraph:
-        """Returns the debt network, simplified, in graph form
+    def _simplify_component(
+        debt_network: flow.FlowGraph,
+        engine: str = "edmonds_karp",
+        stats: Counters | None = None,
+        budget: Budget | None = None,
+    ) -> flow.FlowGraph:
+        """Simplifies the debt network as a whole. If the budget runs out, returns what has been simplified so far
+        with the rest of the network added back on
 
         in pseudocode
 
@@ -132,9 +639,6 @@ class Settle:
 
         """
 
-        # graph cache
-        debt_cache: flow.FlowGraph = copy.deepcopy(debt_network)
-
         # create clean graph with the vertices from the current unsimplified graph
         nodes = [v for v in debt_network.graph.keys()]
         simplified_debt = flow.FlowGraph(vertices=nodes)
@@ -153,15 +657,112 @@ class Settle:
                 except flow.EdgeNotFoundError:
                     continue
 
+                if budget is not None:
+                    if budget.spent():
+                        return Settle._with_remaining(simplified_debt, debt_network)
+                    budget.flows += 1
+
                 # if the max flow between two nodes > 0, add an edge with that max flow to the graph
-                if new_flow := MaxFlow.edmunds_karp(debt_network, node, edge.target):
+                if new_flow := MaxFlow.run(
+                    debt_network, node, edge.target, engine, stats
+                ).value:
                     simplified_debt.add_edge(
                         edge=flow.Edge(edge.target, 0, new_flow), src=node
                     )
 
                 debt_network.prune_edges()
-
-        if simplified_debt == debt_cache:
-            raise NoSimplification("No simplifications were made")
+                if stats is not None:
+                    stats.prune_edges_calls += 1
 
         return simplified_debt
+
+    @staticmethod
+    def _with_remaining(
+        simplified_debt: flow.FlowGraph, debt_network: flow.FlowGraph
+    ) -> flow.FlowGraph:
+        """Returns the simplified debts plus the debts left in the (pruned) network, netted"""
+        debts = [
+            (node, edge.target, edge.capacity)
+            for graph in (simplified_debt, debt_network)
+            for node, edges in graph.graph.items()
+            for edge in edges
+            if not edge.residual
+        ]
+
+        return flow.FlowGraph.from_debts(
+            [v for v in simplified_debt.graph.keys()], debts
+        )
+
+    @staticmethod
+    def settle_balances(balances: dict[flow.Vertex, int]) -> flow.FlowGraph:
+        """Returns a graph of transfers which settles everyone's net balance.
+        balances maps each person to how much they are owed overall (negative where they owe money)
+
+        Greedy: the biggest debtor pays the biggest creditor as much as they can, repeat until everyone is settled.
+        Every transfer settles at least one person, so there are at most V-1 transfers. O(V log V)
+        """
+        if sum(balances.values()):
+            raise UnbalancedDebts("Balances don't add up to 0; can't settle them")
+
+        vertices = [v for v in balances.keys()]
+        settled = flow.FlowGraph(vertices=vertices)
+
+        # max heaps of (-amount, position of vertex)
+        creditors = [
+            (-amount, i) for i, amount in enumerate(balances.values()) if amount > 0
+        ]
+        debtors = [
+            (amount, i) for i, amount in enumerate(balances.values()) if amount < 0
+        ]
+        heapq.heapify(creditors)
+        heapq.heapify(debtors)
+
+        while creditors and debtors:
+            credit, creditor = heapq.heappop(creditors)
+            debt, debtor = heapq.heappop(debtors)
+
+            # debtor pays off as much of the creditor as they can
+            transfer = min(-credit, -debt)
+            settled.add_edge(
+                edge=flow.Edge(vertices[creditor], 0, transfer), src=vertices[debtor]
+            )
+
+            # whoever isn't fully settled goes back in the heap
+            if credit + transfer:
+                heapq.heappush(creditors, (credit + transfer, creditor))
+            if debt + transfer:
+                heapq.heappush(debtors, (debt + transfer, debtor))
+
+        return settled
+
+
+def _simplify_part(
+    part: flow.FlowGraph, engine: str, count: bool = False, budget: Budget | None = None
+) -> tuple[flow.FlowGraph, Counters | None, bool]:
+    """Simplifies one component of a debt network. Returns the simplified component, the work done if count is set,
+    and whether the budget ran out"""
+    stats = Counters() if count else None
+    simplified = Settle._simplify_component(part, engine, stats, budget)
+
+    return simplified, stats, budget is not None and budget.ran_out
+
+
+def _simplify_packed(
+    part: bytes | flow.FlowGraph,
+    engine: str,
+    count: bool = False,
+    budget: Budget | None = None,
+) -> tuple[bytes, Counters | None, bool]:
+    """_simplify_part for worker processes: the component may come in packed (see FlowGraph.pack), and the simplified
+    component always goes back packed. Lives at module level so it can be sent to worker processes
+    """
+    if isinstance(part, bytes):
+        part = flow.FlowGraph.unpack(part)
+
+    simplified, stats, ran_out = _simplify_part(part, engine, count, budget)
+
+    return simplified.pack(), stats, ran_out
+
+
+def _reduce_capacity(edge: flow.Edge, amount: int):
+    edge.capacity -= amount
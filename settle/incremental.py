@@ -0,0 +1,73 @@
+"""Keeps a simplified debt graph up to date as new debts are added"""
+from __future__ import annotations
+
+import settle.flow as flow
+from settle.flow_algorithms import NoSimplification, Settle
+
+
+class IncrementalSettle:
+    """A simplified debt graph which new debts can be folded into.
+
+    Simplifying part of a debt graph keeps everyone's net balance the same, so when a debt is added only the people
+    it touches, and the people they have debts with, are simplified again. The cost depends on the size of that
+    neighbourhood rather than the size of the whole graph
+    """
+
+    def __init__(self, simplified: flow.FlowGraph, engine: str = "edmonds_karp"):
+        self.graph = simplified
+        self.engine = engine
+
+    def add_debt(self, src: flow.Vertex, dest: flow.Vertex, amount: int):
+        """Adds the debt 'src owes dest amount' and simplifies the part of the graph around it"""
+        for v in [src, dest]:
+            if v not in self.graph.graph:
+                self.graph.add_vertex(v)
+
+        self._net(src, dest, amount)
+        self._reoptimise([src, dest])
+
+    def _net(self, src: flow.Vertex, dest: flow.Vertex, amount: int):
+        """Adds src -> dest to the graph, cancelling it against dest -> src if that edge exists"""
+
+        # no debt going the other way; add_edge merges with any src -> dest edge
+        if (opposite := self.graph.unused_capacity(dest, src)) == -1:
+            self.graph.add_edge(edge=flow.Edge(dest, 0, amount), src=src)
+            return
+
+        self.graph.remove_edge(src=dest, target=src)
+
+        if opposite > amount:
+            self.graph.add_edge(edge=flow.Edge(src, 0, opposite - amount), src=dest)
+        elif opposite < amount:
+            self.graph.add_edge(edge=flow.Edge(dest, 0, amount - opposite), src=src)
+
+    def _reoptimise(self, changed: list[flow.Vertex]):
+        """Simplifies the subgraph of the changed vertices and everyone they have an edge with"""
+
+        # residual edges point back at the sources of incoming edges, so all edges give the neighbourhood
+        affected = list(
+            dict.fromkeys(
+                changed + [edge.target for c in changed for edge in self.graph.graph[c]]
+            )
+        )
+
+        try:
+            simplified = Settle.simplify_debt(
+                self.graph.subgraph(affected), self.engine, cancel_cycles=True
+            )
+        except NoSimplification:
+            return
+
+        # swap the edges of the neighbourhood for their simplified version
+        keep = set(affected)
+        for node in affected:
+            for edge in list(self.graph.graph[node]):
+                if not edge.residual and edge.target in keep:
+                    self.graph.remove_edge(src=node, target=edge.target)
+
+        for node, edges in simplified.graph.items():
+            for edge in edges:
+                if not edge.residual:
+                    self.graph.add_edge(
+                        edge=flow.Edge(edge.target, 0, edge.capacity), src=node
+                    )
@@ -0,0 +1,273 @@
+"""Benchmarks each stage of settlement against synthetic debt networks and writes a JSON report.
+
+    python -m test.test_benchmarks.bench_settle --out report.json
+    python -m test.test_benchmarks.bench_settle --shapes star cyclic --sizes 5 50 500 --compare old.json
+
+Stages, each run on a fresh graph of the network:
+    build         FlowGraph.from_debts
+    max_flow      MaxFlow.edmunds_karp from the biggest debtor to the biggest creditor
+    prune_edges   FlowGraph.prune_edges after that max flow
+    simplify_debt Settle.simplify_debt
+    ledger        Ledger.simplified, the part of Ledger.simplify that doesn't touch the database
+
+Once a stage takes longer than --budget on a shape, it is skipped for that shape's larger sizes, so the report shows
+where settlement stops fitting the latency budget without waiting hours for the biggest networks.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Callable
+
+from settle import flow
+from settle.flow_algorithms import MaxFlow, Settle, NoSimplification
+from test.test_benchmarks import networks
+from transactions.ledger import Ledger
+
+SIZES = [5, 50, 500, 5000]
+STAGES = ["build", "max_flow", "prune_edges", "simplify_debt", "ledger"]
+GRAPH_TYPES: dict[str, type[flow.FlowGraph]] = {
+    "list": flow.FlowGraph,
+    "compact": flow.CompactFlowGraph,
+}
+
+# seconds a stage may take before it's skipped for larger networks of the same shape
+BUDGET = 10.0
+
+# how much slower a stage can get before --compare calls it a regression
+REGRESSION_RATIO = 1.25
+
+
+@dataclass
+class Result:
+    shape: str
+    members: int
+    debts: int
+    stage: str
+    seconds: float | None = None
+    peak_bytes: int | None = None
+    skipped: bool = False
+
+
+def _stages(
+    debts: list[networks.Debt], n: int, graph_type: type[flow.FlowGraph]
+) -> dict[str, tuple[Callable[[], Any], Callable[[Any], object]]]:
+    """For every stage: (setup, run), where setup makes the stage's input outside the timed section"""
+    vertices = networks.vertices(n)
+
+    def build():
+        return graph_type.from_debts(
+            vertices, ((vertices[u], vertices[v], a) for u, v, a in debts)
+        )
+
+    # the biggest debtor and creditor, so max flow has something to push
+    balances = [0] * n
+    for u, v, a in debts:
+        balances[u] -= a
+        balances[v] += a
+    src, sink = (
+        vertices[balances.index(min(balances))],
+        vertices[balances.index(max(balances))],
+    )
+
+    def flowed():
+        graph = build()
+        MaxFlow.edmunds_karp(graph, src, sink)
+        return graph
+
+    def simplify(graph):
+        try:
+            Settle.simplify_debt(graph)
+        except NoSimplification:
+            pass
+
+    def simplify_ledger(ledger):
+        try:
+            ledger.simplified()
+        except NoSimplification:
+            pass
+
+    return {
+        "build": (lambda: None, lambda _: build()),
+        "max_flow": (build, lambda graph: MaxFlow.edmunds_karp(graph, src, sink)),
+        "prune_edges": (flowed, lambda graph: graph.prune_edges()),
+        "simplify_debt": (build, simplify),
+        "ledger": (lambda: Ledger(networks.transactions(debts)), simplify_ledger),
+    }
+
+
+def _measure(
+    setup: Callable[[], Any],
+    run: Callable[[Any], object],
+    repeat: int,
+    memory: bool,
+):
+    """Returns the best time of repeat runs, and the peak memory of one more run traced by tracemalloc.
+    Memory is traced in its own run as tracing slows everything down"""
+    seconds = float("inf")
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        seconds = min(seconds, time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        arg = setup()
+        tracemalloc.start()
+        try:
+            run(arg)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return seconds, peak
+
+
+def run(
+    shapes: list[str],
+    sizes: list[int],
+    stages: list[str] = STAGES,
+    *,
+    seed: int = 0,
+    repeat: int = 1,
+    budget: float = BUDGET,
+    memory: bool = True,
+    graph: str = "compact",
+    log=None,
+) -> dict:
+    """Runs the benchmarks and returns the report"""
+    results = []
+
+    for shape in shapes:
+        over_budget: set[str] = set()
+
+        for n in sorted(sizes):
+            debts = networks.generate(shape, n, seed)
+            stage_fns = _stages(debts, n, GRAPH_TYPES[graph])
+
+            for stage in stages:
+                result = Result(shape, n, len(debts), stage)
+
+                if stage in over_budget:
+                    result.skipped = True
+                else:
+                    seconds, result.peak_bytes = _measure(
+                        *stage_fns[stage], repeat, memory
+                    )
+                    result.seconds = seconds
+                    if seconds > budget:
+                        over_budget.add(stage)
+
+                results.append(result)
+                if log:
+                    print(_format(result), file=log)
+
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+            "budget": budget,
+            "graph": graph,
+        },
+        "results": [asdict(r) for r in results],
+    }
+
+
+def compare(old: dict, new: dict, ratio: float = REGRESSION_RATIO) -> list[str]:
+    """Returns a line for every stage that got more than ratio times slower between the two reports"""
+    key = lambda r: (r["shape"], r["members"], r["stage"])  # noqa: E731
+    before = {key(r): r for r in old["results"] if r["seconds"] is not None}
+
+    regressions = []
+    for r in new["results"]:
+        if (
+            r["seconds"] is None
+            or (b := before.get(key(r))) is None
+            or not b["seconds"]
+        ):
+            continue
+        if r["seconds"] / b["seconds"] > ratio:
+            regressions.append(
+                f"{r['shape']} {r['members']} {r['stage']}: {b['seconds']:.4f}s -> {r['seconds']:.4f}s "
+                f"({r['seconds'] / b['seconds']:.2f}x)"
+            )
+
+    return regressions
+
+
+def _format(r: Result) -> str:
+    if r.skipped:
+        return f"{r.shape:>7} {r.members:>5} {r.stage:<14} skipped (over budget)"
+    peak = f"{r.peak_bytes / 1024:10.1f} KiB" if r.peak_bytes is not None else ""
+    return f"{r.shape:>7} {r.members:>5} {r.stage:<14} {r.seconds:10.4f}s {peak}"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--shapes",
+        nargs="+",
+        choices=list(networks.SHAPES),
+        default=list(networks.SHAPES),
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--graph", choices=list(GRAPH_TYPES), default="compact")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--budget", type=float, default=BUDGET, help="seconds before a stage is skipped"
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="don't trace peak memory"
+    )
+    parser.add_argument("--out", help="where to write the JSON report")
+    parser.add_argument(
+        "--compare", help="an earlier report to check for regressions against"
+    )
+    args = parser.parse_args(argv)
+
+    # Ledger.simplified logs every cancelled cycle, which would bury the results
+    logging.getLogger("transactions.ledger").setLevel(logging.WARNING)
+
+    report = run(
+        args.shapes,
+        args.sizes,
+        args.stages,
+        seed=args.seed,
+        repeat=args.repeat,
+        budget=args.budget,
+        memory=not args.no_memory,
+        graph=args.graph,
+        log=sys.stdout,
+    )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report)
+        for line in regressions:
+            print("regression:", line)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
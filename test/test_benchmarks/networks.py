@@ -0,0 +1,111 @@
+"""Seeded synthetic debt networks for the settlement benchmarks.
+
+Every generator takes the number of members and a random.Random, and returns (src, dest, amount) debts between
+member indices 0..n-1. The same seed always gives the same network
+"""
+from __future__ import annotations
+
+import datetime
+import random
+from typing import Callable
+
+from settle.flow import Vertex
+from transactions.transaction import Transaction
+
+Debt = tuple[int, int, int]
+
+# how many others each member of a dense network owes; every other member would be n^2 edges at 5,000 members
+DENSE_DEGREE = 40
+
+MAX_AMOUNT = 100
+
+
+def _amount(rng: random.Random) -> int:
+    return rng.randint(1, MAX_AMOUNT)
+
+
+def _other(n: int, i: int, rng: random.Random) -> int:
+    """A random member other than i"""
+    j = rng.randrange(n - 1)
+    return j + 1 if j >= i else j
+
+
+def random_network(n: int, rng: random.Random) -> list[Debt]:
+    """3n debts between random pairs of members"""
+    debts = []
+    for _ in range(3 * n):
+        i = rng.randrange(n)
+        debts.append((i, _other(n, i, rng), _amount(rng)))
+    return debts
+
+
+def dense_network(n: int, rng: random.Random) -> list[Debt]:
+    """Every member owes up to DENSE_DEGREE others"""
+    debts = []
+    for i in range(n):
+        for j in rng.sample(range(n - 1), min(n - 1, DENSE_DEGREE)):
+            debts.append((i, j + 1 if j >= i else j, _amount(rng)))
+    return debts
+
+
+def sparse_network(n: int, rng: random.Random) -> list[Debt]:
+    """A tree: every member but the first owes one member who joined before them"""
+    return [(i, rng.randrange(i), _amount(rng)) for i in range(1, n)]
+
+
+def cyclic_network(n: int, rng: random.Random) -> list[Debt]:
+    """A ring through every member, with short cycles of 3 to 6 members hung off it"""
+    debts = [(i, (i + 1) % n, _amount(rng)) for i in range(n)]
+
+    for _ in range(n // 4):
+        cycle = rng.sample(range(n), min(n, rng.randint(3, 6)))
+        amount = _amount(rng)
+        debts.extend((u, v, amount) for u, v in zip(cycle, cycle[1:] + cycle[:1]))
+
+    return debts
+
+
+def star_network(n: int, rng: random.Random) -> list[Debt]:
+    """Everyone owes the first member, who owes a few of them back"""
+    debts = [(i, 0, _amount(rng)) for i in range(1, n)]
+    debts.extend((0, i, _amount(rng)) for i in rng.sample(range(1, n), (n - 1) // 10))
+    return debts
+
+
+SHAPES: dict[str, Callable[[int, random.Random], list[Debt]]] = {
+    "random": random_network,
+    "dense": dense_network,
+    "sparse": sparse_network,
+    "cyclic": cyclic_network,
+    "star": star_network,
+}
+
+
+def generate(shape: str, n: int, seed: int = 0) -> list[Debt]:
+    """Returns the debts of the given shape of network between n members"""
+    # seeded by shape and size too, so adding a size doesn't change the others' networks
+    return SHAPES[shape](n, random.Random(f"{seed}-{shape}-{n}"))
+
+
+def vertices(n: int) -> list[Vertex]:
+    return [Vertex(i, f"member {i}") for i in range(n)]
+
+
+def transactions(debts: list[Debt], house_id: int = 1) -> list[Transaction]:
+    """The debts as unpaid transactions of one household, as Ledger is built from"""
+    due = datetime.date(2023, 1, 1)
+    return [
+        Transaction(
+            t_id,
+            src,
+            dest,
+            f"member {src}",
+            f"member {dest}",
+            amount,
+            "benchmark",
+            due,
+            False,
+            house_id,
+        )
+        for t_id, (src, dest, amount) in enumerate(debts, start=1)
+    ]
@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+from test.test_benchmarks import bench_settle, networks
+
+
+class TestNetworks(TestCase):
+    def test_generate(self):
+        for shape in networks.SHAPES:
+            with self.subTest(shape):
+                debts = networks.generate(shape, 20, seed=1)
+
+                self.assertEqual(debts, networks.generate(shape, 20, seed=1))
+                self.assertTrue(
+                    all(
+                        0 <= u < 20 and 0 <= v < 20 and u != v and a > 0
+                        for u, v, a in debts
+                    )
+                )
+
+
+class TestBenchSettle(TestCase):
+    def test_run(self):
+        report = bench_settle.run(list(networks.SHAPES), [5, 10])
+        results = report["results"]
+
+        with self.subTest("Every stage of every network"):
+            self.assertEqual(
+                len(results), len(networks.SHAPES) * 2 * len(bench_settle.STAGES)
+            )
+
+        with self.subTest("Measured"):
+            self.assertTrue(
+                all(
+                    r["seconds"] is not None and r["peak_bytes"] is not None
+                    for r in results
+                )
+            )
+
+    def test_budget(self):
+        """Stages over budget are skipped for larger networks"""
+        report = bench_settle.run(["star"], [5, 10], ["build"], budget=0, memory=False)
+
+        self.assertEqual([r["skipped"] for r in report["results"]], [False, True])
+
+    def test_compare(self):
+        old = bench_settle.run(["star"], [5], ["build"], memory=False)
+        new = bench_settle.run(["star"], [5], ["build"], memory=False)
+        new["results"][0]["seconds"] = old["results"][0]["seconds"] * 2 + 1
+
+        self.assertEqual(len(bench_settle.compare(old, new)), 1)
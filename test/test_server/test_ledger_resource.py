@@ -3,6 +3,8 @@ from unittest import TestCase
 
 import requests
 
+from transactions.ledger import PAGE_SIZE
+
 
 class TestLedgerResource(TestCase):
     def test_get(self):
@@ -25,6 +27,48 @@ class TestLedgerResource(TestCase):
         with self.subTest("Expect 404 where user doesn't exist"):
             self.assertEqual(r.status_code, 404)
 
+    def test_get_page(self):
+        """Checks pages are cut short, and that bad query parameters are refused"""
+
+        r = requests.get("http://127.0.0.1:5000/ledger/3?paid=false&limit=1")
+
+        with self.subTest("One page"):
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(1, len(json.loads(r.json())))
+            self.assertNotIn("X-Next-Cursor", r.headers)
+
+        r = requests.get("http://127.0.0.1:5000/ledger/3")
+
+        with self.subTest("Paged by default"):
+            self.assertEqual(r.status_code, 200)
+            self.assertLessEqual(len(json.loads(r.json())), PAGE_SIZE)
+
+        for query in [
+            "paid=maybe",
+            "limit=0",
+            "due_from=yesterday",
+            "counterparty=a",
+            "cursor=abc",
+        ]:
+            with self.subTest(query):
+                self.assertEqual(
+                    requests.get(f"http://127.0.0.1:5000/ledger/3?{query}").status_code,
+                    400,
+                )
+
+    def test_balances(self):
+        r = requests.get("http://127.0.0.1:5000/balances/3")
+
+        with self.subTest("Balances add up to nothing"):
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(0, sum(b["balance"] for b in json.loads(r.json())))
+
+        with self.subTest("Expect 404 where household doesn't exist"):
+            self.assertEqual(
+                requests.get("http://127.0.0.1:5000/balances/34523452354").status_code,
+                404,
+            )
+
     def test_post(self):
         r = requests.post("http://127.0.0.1:5000/3/simplify")
         self.assertEqual(r.status_code, 200)
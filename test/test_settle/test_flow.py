@@ -1,5 +1,8 @@
 from unittest import TestCase
 
+import copy
+import pickle
+
 from settle.flow import *
 
 
@@ -16,7 +19,41 @@ class TestEdge(TestCase):
             edge.push_flow(4)
 
 
+class TestVertex(TestCase):
+    def test_eq_hash(self):
+        a = Vertex(0, "A")
+
+        with self.subTest("Equal"):
+            self.assertEqual(a, Vertex(0, "A"))
+            self.assertEqual(hash(a), hash(Vertex(0, "A")))
+
+        with self.subTest("Not equal"):
+            self.assertNotEqual(a, Vertex(1, "A"))
+            self.assertNotEqual(a, Vertex(0, "B"))
+            self.assertNotEqual(Vertex(1, "1x"), Vertex(11, "x"))
+
+        with self.subTest("Repr"):
+            self.assertEqual("Vertex(v_id=0, label='A')", repr(a))
+
+        with self.subTest("Slots"):
+            self.assertFalse(hasattr(a, "__dict__"))
+            self.assertFalse(hasattr(Edge(a, 0, 0), "__dict__"))
+
+    def test_copy(self):
+        a = Vertex(0, "A")
+
+        for name, clone in [
+            ("Pickle", pickle.loads(pickle.dumps(a))),
+            ("Deep copy", copy.deepcopy(a)),
+        ]:
+            with self.subTest(name):
+                self.assertEqual(a, clone)
+                self.assertEqual(hash(a), hash(clone))
+
+
 class TestFlowGraph(TestCase):
+    graph_type: type[FlowGraph] = FlowGraph
+
     def setUp(self) -> None:
         """create a blank test graph with three nodes: {A, B, C}
 
@@ -36,9 +73,9 @@ class TestFlowGraph(TestCase):
 
         self.vertices = [self.a, self.b, self.c, self.d]
 
-        self.blank_graph = FlowGraph(vertices=self.vertices)
+        self.blank_graph = self.graph_type(vertices=self.vertices)
 
-        self.test_graph = FlowGraph(vertices=self.vertices)
+        self.test_graph = self.graph_type(vertices=self.vertices)
 
         # add edges to the graph only between a, b, c; leave d unconnected
         self.test_graph.add_edge(edge=Edge(self.b, 0, 10), src=self.a)
@@ -46,7 +83,7 @@ class TestFlowGraph(TestCase):
         self.test_graph.add_edge(edge=Edge(self.c, 0, 15), src=self.a)
 
     def test_add_vertex(self):
-        g = FlowGraph()
+        g = self.graph_type()
 
         with self.subTest("Blank creation"):
             self.assertEqual(g.graph, {})
@@ -95,6 +132,72 @@ class TestFlowGraph(TestCase):
         with self.subTest("Block 2 way edge"), self.assertRaises(FlowGraphError):
             self.blank_graph.add_edge(edge=Edge(self.a, 5, 5), src=self.b)
 
+    def test_intern(self):
+        copy_of_b = Vertex(1, "B")
+        self.test_graph.add_edge(edge=Edge(copy_of_b, 0, 5), src=Vertex(3, "D"))
+
+        with self.subTest("Known vertex"):
+            self.assertIs(self.b, self.test_graph.intern(copy_of_b))
+
+        with self.subTest("Unknown vertex"):
+            e = Vertex(4, "E")
+            self.assertIs(e, self.test_graph.intern(e))
+
+        with self.subTest("Edges point at the graph's vertices"):
+            self.assertIs(self.b, self.test_graph.get_edge(self.d, self.b).target)
+
+    def test_from_debts(self):
+        a, b, c, d = self.vertices
+        debts = [
+            (a, b, 10),
+            (b, a, 4),
+            (a, b, 1),
+            (c, d, 5),
+            (d, c, 5),
+            (b, c, 2),
+            (a, a, 3),
+        ]
+
+        graph = self.graph_type.from_debts(self.vertices, debts)
+
+        with self.subTest("Type"):
+            self.assertIsInstance(graph, self.graph_type)
+
+        with self.subTest("Netted"):
+            self.assertEqual(frozenset({(0, 1, 7), (1, 2, 2)}), graph.fingerprint())
+
+    def test_pack(self):
+        a, b, c, d = self.vertices
+        self.test_graph.add_vertex(Vertex(4, "Zoë"))
+        self.test_graph.augment_flow([a, b, c], 5)
+
+        packed = self.test_graph.pack()
+        graph = self.graph_type.unpack(packed)
+
+        with self.subTest("Type"):
+            self.assertIsInstance(graph, self.graph_type)
+
+        with self.subTest("Same edges"):
+            self.assertEqual(self.test_graph, graph)
+
+        with self.subTest("Residual flow kept"):
+            self.assertEqual(5, graph.unused_capacity(b, a, residual=True))
+
+        with self.subTest("Labels kept"):
+            self.assertEqual(
+                ["A", "B", "C", "D", "Zoë"], [v.label for v in graph.graph.keys()]
+            )
+
+        with self.subTest("From a memoryview"):
+            self.assertEqual(
+                self.test_graph, self.graph_type.unpack(memoryview(bytearray(packed)))
+            )
+
+        with self.subTest("Not packed"):
+            self.assertRaises(
+                FlowGraphError, self.graph_type.unpack, pickle.dumps(self.test_graph)
+            )
+
     def test_unused_capacity(self):
         """Checks that edge detection works, and that we return the correct unused capacities where they do exist"""
 
@@ -125,6 +228,43 @@ class TestFlowGraph(TestCase):
             self.test_graph.graph,
         )
 
+    def test_incoming_index(self):
+        """The incoming edge index stays in step with the adjacency lists"""
+        if self.graph_type is not FlowGraph:
+            self.skipTest(
+                "CompactFlowGraph finds incoming edges through their residual edges"
+            )
+
+        a, b, c, d = self.vertices
+        graph = self.test_graph
+
+        def incoming() -> dict[Vertex, set[Vertex]]:
+            index: dict[Vertex, set[Vertex]] = {v: set() for v in graph.graph.keys()}
+            for u, edges in graph.graph.items():
+                for edge in edges:
+                    index[edge.target].add(u)
+            return index
+
+        graph.add_edge(edge=Edge(a, 0, 5), src=d)
+        graph.augment_flow([a, c], 15)
+        graph.prune_edges()
+
+        with self.subTest("Add and prune"):
+            self.assertEqual(
+                incoming(), {v: set(us) for v, us in graph._incoming.items()}
+            )
+
+        graph.remove_vertex(b)
+        graph.remove_edge(src=d, target=a)
+
+        with self.subTest("Remove"):
+            self.assertEqual(
+                incoming(), {v: set(us) for v, us in graph._incoming.items()}
+            )
+
+        with self.subTest("No edges left"):
+            self.assertEqual({a: [], c: [], d: []}, graph.graph)
+
     def test_remove_edge(self):
         A, B, C, D = self.vertices
         self.blank_graph.add_edge(edge=Edge(B, 0, 10), src=A)
@@ -167,5 +307,89 @@ class TestFlowGraph(TestCase):
             with self.subTest(test):
                 self.assertEqual(self.test_graph.unused_capacity(*case), exp)
 
+    def test_prune_edges_in_place(self):
+        """Unsaturated edges keep their place; residual flow is reset"""
+        a, b, c, d = self.vertices
+
+        self.test_graph.augment_flow([a, b, c], 5)
+        self.test_graph.prune_edges()
+
+        with self.subTest("Edge order kept"):
+            self.assertEqual([Edge(b, 0, 5), Edge(c, 0, 15)], self.test_graph.graph[a])
+
+        with self.subTest("Residual reset"):
+            self.assertEqual([Edge(a, 0, 0)], self.test_graph.graph[b])
+
+    def test_edge_count(self):
+        with self.subTest("Test graph"):
+            self.assertEqual(3, self.test_graph.edge_count())
+
+        with self.subTest("Blank graph"):
+            self.assertEqual(0, self.blank_graph.edge_count())
+
+    def test_weakly_connected_components(self):
+        a, b, c, d = self.vertices
+        self.test_graph.remove_edge(src=a, target=b)
+
+        self.assertEqual(
+            [[a, b, c], [d]], self.test_graph.weakly_connected_components()
+        )
+
+    def test_fingerprint(self):
+        a, b, c, d = self.vertices
+
+        with self.subTest("Edges"):
+            self.assertEqual(
+                frozenset({(0, 1, 10), (1, 2, 5), (0, 2, 15)}),
+                self.test_graph.fingerprint(),
+            )
+
+        # same debts added in a different order
+        other = self.graph_type(vertices=self.vertices)
+        other.add_edge(edge=Edge(c, 0, 15), src=a)
+        other.add_edge(edge=Edge(c, 0, 5), src=b)
+        other.add_edge(edge=Edge(b, 0, 10), src=a)
+
+        with self.subTest("Order doesn't matter"):
+            self.assertEqual(self.test_graph.fingerprint(), other.fingerprint())
+
     def test_draw(self):
         self.test_graph.draw(filename="test")
+
+    def test_dot(self):
+        source = self.test_graph.dot(res=False).source
+
+        with self.subTest("Vertices"):
+            for v in self.test_graph.graph.keys():
+                self.assertIn(v.label, source)
+
+        with self.subTest("No residual edges"):
+            self.assertNotIn("red", source)
+
+
+class TestCompactFlowGraph(TestFlowGraph):
+    """Runs every FlowGraph test against the array backed graph"""
+
+    graph_type = CompactFlowGraph
+
+    def test_from_flow_graph(self):
+        a, b, c, d = self.vertices
+        graph = FlowGraph(vertices=self.vertices)
+        graph.add_edge(edge=Edge(b, 0, 10), src=a)
+        graph.add_edge(edge=Edge(c, 0, 5), src=b)
+        graph.augment_flow([a, b, c], 5)
+
+        compact = CompactFlowGraph.from_flow_graph(graph)
+
+        with self.subTest("Same edges"):
+            self.assertEqual(graph, compact)
+
+        with self.subTest("Residual flow kept"):
+            self.assertEqual(compact.unused_capacity(c, b, residual=True), 5)
+
+    def test_edge_slots_reused(self):
+        a, b, c, d = self.vertices
+        self.test_graph.remove_edge(src=a, target=b)
+        self.test_graph.add_edge(edge=Edge(d, 0, 1), src=c)
+
+        self.assertEqual(len(self.test_graph._target), 6)
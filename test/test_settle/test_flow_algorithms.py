@@ -1,4 +1,6 @@
-from unittest import TestCase
+import copy
+import random
+from unittest import TestCase, mock
 
 from settle.flow_algorithms import *
 
@@ -39,6 +41,61 @@ class TestMaxFlow(TestCase):
         karp = MaxFlow.edmunds_karp(self.test_graph, s, t)
         self.assertEqual(20, karp)
 
+    def test_dinic(self):
+        s, a, b, c, d, t = self.vertices
+
+        self.assertEqual(20, MaxFlow.dinic(self.test_graph, s, t))
+
+    def test_push_relabel(self):
+        s, a, b, c, d, t = self.vertices
+
+        self.assertEqual(20, MaxFlow.push_relabel(self.test_graph, s, t))
+
+        # push relabel must leave a valid flow behind: nothing stuck at intermediate vertices
+        for v in [a, b, c, d]:
+            with self.subTest(f"Conservation at {v.label}"):
+                into = sum(
+                    e.flow
+                    for u, edges in self.test_graph.graph.items()
+                    for e in edges
+                    if e.target == v and not e.residual
+                )
+                out = sum(e.flow for e in self.test_graph.graph[v] if not e.residual)
+                self.assertEqual(into, out)
+
+    def test_run(self):
+        s, a, b, c, d, t = self.vertices
+
+        for engine in ENGINES:
+            with self.subTest(engine):
+                graph = copy.deepcopy(self.test_graph)
+                self.assertEqual(
+                    FlowResult(20, engine), MaxFlow.run(graph, s, t, engine)
+                )
+
+        with self.subTest("Unknown engine"), self.assertRaises(EngineNotFound):
+            MaxFlow.run(self.test_graph, s, t, "ford_fulkerson")
+
+    def test_run_counters(self):
+        s, a, b, c, d, t = self.vertices
+
+        for engine in ENGINES:
+            stats = Counters()
+            result = MaxFlow.run(copy.deepcopy(self.test_graph), s, t, engine, stats)
+
+            with self.subTest(engine):
+                self.assertIs(stats, result.stats)
+                self.assertGreater(stats.augmentations, 0)
+                self.assertGreater(stats.vertices_dequeued, 0)
+                self.assertGreater(stats.edges_scanned, 0)
+
+        with self.subTest(
+            "Edmonds-Karp: one bfs per path, plus one to find there are none left"
+        ):
+            stats = Counters()
+            MaxFlow.edmunds_karp(self.test_graph, s, t, stats)
+            self.assertEqual(stats.bfs_runs, stats.augmentations + 1)
+
     def test_bottleneck(self):
         s, a, b, c, d, t = self.vertices
 
@@ -59,44 +116,45 @@ class TestMaxFlow(TestCase):
         # check that every item in the list is 10 (the bottleneck for the path)
         self.assertEqual(flows.count(10), len(flows))
 
-    def test__bfs(self):
+    def test_path_search_from_any_vertex(self):
         s, a, b, c, d, t = self.vertices
+        search = PathSearch(self.test_graph)
 
-        exp = [s, a, c, t]
-        actual = MaxFlow._bfs(self.test_graph, s, t)
+        with self.subTest("Path from an inner vertex"):
+            self.assertEqual(([a, c, t], 10), search.shortest_path(a, t))
 
-        self.assertEqual(exp, actual)
+        # nothing leaves the sink, so there is no path back to the source
+        with self.subTest("No path"):
+            self.assertEqual(([], 0), search.shortest_path(t, s))
 
-    def test__path_from_map(self):
+    def test_path_search(self):
         s, a, b, c, d, t = self.vertices
+        search = PathSearch(self.test_graph)
 
-        test_map: dict[flow.Vertex, flow.Vertex | None] = {
-            s: None,
-            a: d,
-            b: s,
-            c: None,
-            d: b,
-            t: None,
-        }
+        # s's edge to b was added first, so b's path is found first
+        with self.subTest("Path and bottleneck"):
+            self.assertEqual(([s, b, d, t], 10), search.shortest_path(s, t))
 
-        # check that an empty path is returned when nothing points to the sink node
-        with self.subTest("Invalid map - nothing pointing to sink node"):
-            got = MaxFlow._path_from_map(test_map, src=s, sink=t)
-            self.assertFalse(got)
+        # the workspace is reused for the next search, after the path is used up
+        self.test_graph.augment_flow([s, b, d, t], 10)
 
-        # fix the map
-        test_map[t] = d
+        with self.subTest("Next path"):
+            self.assertEqual(([s, a, c, t], 10), search.shortest_path(s, t))
 
-        with self.subTest("Build map"):
-            self.assertEqual(
-                MaxFlow._path_from_map(test_map, src=s, sink=t), [s, b, d, t]
-            )
+        self.test_graph.augment_flow([s, a, c, t], 10)
 
-        # break the path and make sure an error is raised
-        test_map[b] = None
+        with self.subTest("No path left"):
+            self.assertEqual(([], 0), search.shortest_path(s, t))
 
-        with self.subTest("Path broken midway through"), self.assertRaises(PathError):
-            MaxFlow._path_from_map(test_map, src=s, sink=t)
+    def test_path_search__path(self):
+        s, a, b, c, d, t = self.vertices
+        search = PathSearch(self.test_graph)
+
+        # a path is rebuilt by following parents back from the sink
+        search._parent.update({a: d, b: s, d: b, t: d})
+
+        self.assertEqual([s, b, d, t], search._path(s, t))
+        self.assertEqual([b, d, t], search._path(b, t))
 
 
 class TestSettle(TestCase):
@@ -151,3 +209,201 @@ class TestSettle(TestCase):
 
         with self.assertRaises(NoSimplification):
             Settle.simplify_debt(debt)
+
+    def test_simplify_debt_engines(self):
+        """Every engine simplifies the example from test_simplify_debt to Alice owes Bob $15"""
+
+        for engine in ENGINES:
+            vertices = [
+                flow.Vertex(0, "Alice"),
+                flow.Vertex(1, "Bob"),
+                flow.Vertex(2, "Charlie"),
+            ]
+            a, b, c = vertices
+
+            debt = flow.FlowGraph(vertices=vertices)
+            debt.add_edge(edge=flow.Edge(b, 0, 10), src=a)
+            debt.add_edge(edge=flow.Edge(b, 0, 5), src=c)
+            debt.add_edge(edge=flow.Edge(c, 0, 5), src=a)
+
+            settled = Settle.simplify_debt(debt, engine)
+
+            with self.subTest(engine):
+                self.assertEqual(settled.unused_capacity(a, b), 15)
+                self.assertEqual(settled.unused_capacity(c, b), -1)
+
+    def test_simplify_debt_components(self):
+        """Two households' worth of the example in test_simplify_debt, with no debts between them.
+        Each is simplified on its own, with and without a process pool"""
+
+        for workers in [1, 2]:
+            vertices = [flow.Vertex(i, f"{i}") for i in range(6)]
+            debt = flow.CompactFlowGraph(vertices=vertices)
+
+            for a, b, c in [vertices[:3], vertices[3:]]:
+                debt.add_edge(edge=flow.Edge(b, 0, 10), src=a)
+                debt.add_edge(edge=flow.Edge(b, 0, 5), src=c)
+                debt.add_edge(edge=flow.Edge(c, 0, 5), src=a)
+
+            with mock.patch("settle.flow_algorithms.PARALLEL_MIN_EDGES", 1):
+                settled = Settle.simplify_debt(debt, workers=workers)
+
+            with self.subTest(workers=workers):
+                self.assertEqual(
+                    frozenset({(0, 1, 15), (3, 4, 15)}), settled.fingerprint()
+                )
+
+    def test_simplify_debt_compact(self):
+        """Simplifying a CompactFlowGraph gives the same result as simplifying a FlowGraph"""
+
+        for seed in range(20):
+            rand = random.Random(seed)
+            vertices = [flow.Vertex(i, f"{i}") for i in range(8)]
+            debts = []
+            for _ in range(16):
+                u, v = rand.sample(vertices, 2)
+                if (v, u) not in [d[:2] for d in debts]:
+                    debts.append((u, v, rand.randint(1, 50)))
+
+            results = []
+            for graph_type in [flow.FlowGraph, flow.CompactFlowGraph]:
+                debt = graph_type(vertices=vertices)
+                for u, v, amount in debts:
+                    debt.add_edge(edge=flow.Edge(v, 0, amount), src=u)
+
+                try:
+                    results.append(dict(Settle.simplify_debt(debt).graph.items()))
+                except NoSimplification:
+                    results.append(None)
+
+            with self.subTest(seed=seed):
+                self.assertEqual(*results)
+
+    def test_cancel_cycles(self):
+        """A owes B 5, B owes C 10, C owes A 5, C owes D 3 leaves B owes C 5, C owes D 3"""
+        a, b, c, d = [flow.Vertex(i, label) for i, label in enumerate("ABCD")]
+
+        debt = flow.FlowGraph(vertices=[a, b, c, d])
+        debt.add_edge(edge=flow.Edge(b, 0, 5), src=a)
+        debt.add_edge(edge=flow.Edge(c, 0, 10), src=b)
+        debt.add_edge(edge=flow.Edge(a, 0, 5), src=c)
+        debt.add_edge(edge=flow.Edge(d, 0, 3), src=c)
+
+        with self.subTest("Amount cancelled"):
+            self.assertEqual(15, Settle.cancel_cycles(debt))
+
+        with self.subTest("Edges left"):
+            self.assertEqual(frozenset({(1, 2, 5), (2, 3, 3)}), debt.fingerprint())
+
+    def test_simplify_cancel_cycles(self):
+        """A cycle on its own can't be simplified by max flow, but cancels out"""
+        vertices = [flow.Vertex(i, label) for i, label in enumerate("ABC")]
+        a, b, c = vertices
+
+        def cycle() -> flow.FlowGraph:
+            debt = flow.FlowGraph(vertices=vertices)
+            debt.add_edge(edge=flow.Edge(b, 0, 5), src=a)
+            debt.add_edge(edge=flow.Edge(c, 0, 5), src=b)
+            debt.add_edge(edge=flow.Edge(a, 0, 5), src=c)
+            return debt
+
+        with self.subTest("Without cancelling"), self.assertRaises(NoSimplification):
+            Settle.simplify(cycle())
+
+        settlement = Settle.simplify(cycle(), cancel_cycles=True)
+
+        with self.subTest("With cancelling"):
+            self.assertEqual(
+                Settlement(flow.FlowGraph(vertices=vertices), 15), settlement
+            )
+
+    def test_simplify_counters(self):
+        """Counters are only collected when asked for, and are passed to hooks"""
+        vertices = [flow.Vertex(i, label) for i, label in enumerate("ABC")]
+        a, b, c = vertices
+
+        def debt() -> flow.FlowGraph:
+            graph = flow.FlowGraph(vertices=vertices)
+            graph.add_edge(edge=flow.Edge(b, 0, 10), src=a)
+            graph.add_edge(edge=flow.Edge(b, 0, 5), src=c)
+            graph.add_edge(edge=flow.Edge(c, 0, 5), src=a)
+            return graph
+
+        with self.subTest("Not asked for"):
+            self.assertIsNone(Settle.simplify(debt()).stats)
+
+        stats = Counters()
+        settlement = Settle.simplify(debt(), stats=stats)
+
+        with self.subTest("Asked for"):
+            self.assertIs(stats, settlement.stats)
+            self.assertGreater(stats.bfs_runs, 0)
+            self.assertEqual(stats.prune_edges_calls, 1)
+
+        seen = []
+        add_stats_hook(seen.append)
+        try:
+            settlement = Settle.simplify(debt())
+        finally:
+            remove_stats_hook(seen.append)
+
+        with self.subTest("Hook"):
+            self.assertEqual([settlement.stats], seen)
+            self.assertEqual(stats, settlement.stats)
+
+    def test_simplify_budget(self):
+        """Running out of budget gives a partial simplification that still settles everyone's balance"""
+
+        def balances(graph: flow.FlowGraph) -> dict[int, int]:
+            b: dict[int, int] = {}
+            for src, target, amount in graph.fingerprint():
+                b[src] = b.get(src, 0) - amount
+                b[target] = b.get(target, 0) + amount
+            return {v: amount for v, amount in b.items() if amount}
+
+        rand = random.Random(0)
+        vertices = [flow.Vertex(i, f"{i}") for i in range(10)]
+        debts = []
+        for _ in range(30):
+            u, v = rand.sample(vertices, 2)
+            debts.append((u, v, rand.randint(1, 50)))
+
+        expected = balances(flow.FlowGraph.from_debts(vertices, debts))
+
+        with self.subTest("No budget"):
+            self.assertFalse(
+                Settle.simplify(flow.FlowGraph.from_debts(vertices, debts)).partial
+            )
+
+        budget = Budget(max_flows=2)
+        settlement = Settle.simplify(
+            flow.FlowGraph.from_debts(vertices, debts), budget=budget
+        )
+
+        with self.subTest("Partial"):
+            self.assertTrue(budget.ran_out)
+            self.assertTrue(settlement.partial)
+            self.assertEqual(expected, balances(settlement.graph))
+
+        with self.subTest("Out of time"), self.assertRaises(NoSimplification):
+            Settle.simplify(
+                flow.FlowGraph.from_debts(vertices, debts), budget=Budget(seconds=0)
+            )
+
+    def test_settle_balances(self):
+        """Alice owes $15 and Charlie owes $5; Bob is owed $20. Two transfers settle everyone"""
+
+        a, b, c, d = [flow.Vertex(i, label) for i, label in enumerate("ABCD")]
+
+        settled = Settle.settle_balances({a: -15, b: 20, c: -5, d: 0})
+
+        with self.subTest("Transfers"):
+            self.assertEqual(settled.unused_capacity(a, b), 15)
+            self.assertEqual(settled.unused_capacity(c, b), 5)
+
+        with self.subTest("At most V-1 transfers"):
+            edges = [e for es in settled.graph.values() for e in es if not e.residual]
+            self.assertEqual(len(edges), 2)
+
+        with self.subTest("Unbalanced"), self.assertRaises(UnbalancedDebts):
+            Settle.settle_balances({a: -15, b: 10})
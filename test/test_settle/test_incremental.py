@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from settle.flow import *
+from settle.incremental import IncrementalSettle
+
+
+class TestIncrementalSettle(TestCase):
+    def setUp(self) -> None:
+        """Simplified graph: A owes B 10, C owes B 5"""
+        self.a, self.b, self.c, self.d = [
+            Vertex(i, label) for i, label in enumerate("ABCD")
+        ]
+
+        graph = FlowGraph(vertices=[self.a, self.b, self.c])
+        graph.add_edge(edge=Edge(self.b, 0, 10), src=self.a)
+        graph.add_edge(edge=Edge(self.b, 0, 5), src=self.c)
+
+        self.settle = IncrementalSettle(graph)
+
+    def test_add_debt(self):
+        """A owes C 5; C can be settled out so A owes B 15"""
+        self.settle.add_debt(self.a, self.c, 5)
+
+        self.assertEqual(frozenset({(0, 1, 15)}), self.settle.graph.fingerprint())
+
+    def test_add_debt_new_vertex(self):
+        """D owes A 3; nothing to simplify, but the debt is added"""
+        self.settle.add_debt(self.d, self.a, 3)
+
+        self.assertEqual(
+            frozenset({(0, 1, 10), (2, 1, 5), (3, 0, 3)}),
+            self.settle.graph.fingerprint(),
+        )
+
+    def test_add_debt_opposite(self):
+        """B owes A 4; nets against A owes B 10"""
+        self.settle.add_debt(self.b, self.a, 4)
+
+        with self.subTest("Netted"):
+            self.assertEqual(self.settle.graph.unused_capacity(self.a, self.b), 6)
+
+        with self.subTest("No edge going the other way"):
+            self.assertEqual(self.settle.graph.unused_capacity(self.b, self.a), -1)
+
+        self.settle.add_debt(self.b, self.a, 6)
+
+        with self.subTest("Cancelled out"):
+            self.assertEqual(frozenset({(2, 1, 5)}), self.settle.graph.fingerprint())
+
+    def test_add_debt_cycle(self):
+        """B owes C 5; C owes B 5 is cancelled, and A owes B 10, B owes C 5 go round a cycle when C owes A 5"""
+        self.settle.add_debt(self.b, self.c, 5)
+
+        with self.subTest("Netted"):
+            self.assertEqual(frozenset({(0, 1, 10)}), self.settle.graph.fingerprint())
+
+        self.settle.add_debt(self.b, self.c, 5)
+        self.settle.add_debt(self.c, self.a, 5)
+
+        with self.subTest("Cycle cancelled"):
+            self.assertEqual(frozenset({(0, 1, 5)}), self.settle.graph.fingerprint())
@@ -0,0 +1,143 @@
+import datetime
+from dataclasses import replace
+from unittest import TestCase, mock
+
+import mysql.connector
+
+from test.test_transactions.test_ledger import setup_db_test_rows
+from transactions import batch
+from transactions.ledger import Ledger
+from transactions.transaction import Transaction
+
+
+class TestBatchDB(TestCase):
+    def setUp(self) -> None:
+        """Make sure relevant rows are present in database"""
+
+        rows = [
+            (428, 8, 10, "a->b", datetime.date(2023, 3, 13), 0),
+            (429, 9, 5, "c->b", datetime.date(2023, 3, 13), 0),
+            (430, 10, 5, "a->c", datetime.date(2023, 3, 13), 0),
+        ]
+
+        setup_db_test_rows(rows)
+
+        self.conn = mysql.connector.connect(
+            host="localhost", user="root", password="I_love_stew!12", database="x5db"
+        )
+        self.db = self.conn.cursor()
+
+    def test_load_ledgers(self):
+        ledgers = batch.load_ledgers(self.db, [3])
+
+        self.assertEqual(
+            Ledger.build_from_house_id(3, self.db).transactions,
+            sorted(ledgers[3].transactions, key=lambda t: t.t_id),
+        )
+
+    def test_run(self):
+        stats = batch.run(self.db, self.conn, [3], workers=1)
+
+        with self.subTest("Stats"):
+            self.assertEqual((1, 1), (stats.households, stats.simplified))
+            self.assertEqual(
+                (3, 1), (stats.transactions_before, stats.transactions_after)
+            )
+
+        with self.subTest("Written"):
+            self.assertEqual(
+                1, len(Ledger.build_from_house_id(3, self.db).transactions)
+            )
+
+
+class TestBatch(TestCase):
+    def setUp(self) -> None:
+        """Two households: a owes b 10, c owes b 5, a owes c 5 (simplifies), and d owes e 5 (doesn't)"""
+        due = datetime.date(2023, 3, 13)
+        self.ledgers = {
+            3: Ledger(
+                [
+                    Transaction(428, 5, 6, "a", "b", 10, "a->b", due, False, 3),
+                    Transaction(429, 7, 6, "c", "b", 5, "c->b", due, False, 3),
+                    Transaction(430, 5, 7, "a", "c", 5, "a->c", due, False, 3),
+                ]
+            ),
+            4: Ledger([Transaction(431, 8, 9, "d", "e", 5, "d->e", due, False, 4)]),
+        }
+
+    def test_simplify_house(self):
+        result = batch.simplify_house(3, self.ledgers[3], "greedy")
+
+        with self.subTest("Simplified"):
+            self.assertEqual([(5, "a", 6, "b", 15)], result.transfers)
+            self.assertEqual([428, 429, 430], result.t_ids)
+
+        with self.subTest("No simplification"):
+            self.assertIsNone(batch.simplify_house(4, self.ledgers[4]).transfers)
+
+    def test_simplify_all(self):
+        """The same results with and without a process pool"""
+        for workers in [1, 2]:
+            results = {
+                r.house_id: r.transfers
+                for r in batch.simplify_all(self.ledgers, "greedy", workers)
+            }
+
+            with self.subTest(workers=workers):
+                self.assertEqual({3: [(5, "a", 6, "b", 15)], 4: None}, results)
+
+    def test_write_results(self):
+        """Households whose transactions changed since they were loaded aren't written"""
+        ledger = Ledger([replace(t, house_id=5) for t in self.ledgers[3].transactions])
+        results = [
+            batch.simplify_house(3, self.ledgers[3], "greedy"),
+            batch.simplify_house(4, self.ledgers[4], "greedy"),
+            batch.simplify_house(5, ledger, "greedy"),
+        ]
+
+        # household 5 has had a transaction added since
+        cur, conn = mock.MagicMock(), mock.MagicMock()
+        cur.fetchall.return_value = [
+            (3, 428, 5, 6, 10),
+            (3, 429, 7, 6, 5),
+            (3, 430, 5, 7, 5),
+            (5, 428, 5, 6, 10),
+            (5, 429, 7, 6, 5),
+            (5, 430, 5, 7, 5),
+            (5, 432, 6, 5, 1),
+        ]
+
+        with mock.patch.object(batch, "replace_transactions") as replace_transactions:
+            changed = batch.write_results(results, cur, conn)
+
+        with self.subTest("Locked"):
+            self.assertIn("FOR UPDATE", cur.execute.call_args.args[0])
+            self.assertEqual([3, 5], cur.execute.call_args.args[1])
+
+        with self.subTest("Changed household skipped"):
+            self.assertEqual([5], [r.house_id for r in changed])
+            self.assertEqual([428, 429, 430], replace_transactions.call_args.args[1])
+            self.assertEqual(1, len(replace_transactions.call_args.args[2]))
+
+        with self.subTest("Committed"):
+            self.assertEqual(1, conn.commit.call_count)
+
+    def test_run_unwritten(self):
+        """Households that aren't written keep their transactions in the stats"""
+        cur, conn = mock.MagicMock(), mock.MagicMock()
+        load = mock.patch.object(batch, "load_ledgers", return_value=self.ledgers)
+
+        for outcome, side_effect in [
+            ("failed", mysql.connector.Error("write failed")),
+            ("changed", lambda results, cur, conn: results[:1]),
+        ]:
+            with self.subTest(outcome), load, mock.patch.object(
+                batch, "write_results", side_effect=side_effect
+            ):
+                stats = batch.run(cur, conn, method="greedy", workers=1)
+
+                self.assertEqual(1, getattr(stats, outcome))
+                self.assertEqual(0, stats.simplified)
+                self.assertEqual(
+                    (4, 4), (stats.transactions_before, stats.transactions_after)
+                )
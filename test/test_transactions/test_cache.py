@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+from transactions.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_eviction(self):
+        cache: LRUCache[str, int] = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+
+        # using 'a' makes 'b' the least recently used
+        with self.subTest("Get"):
+            self.assertEqual(cache.get("a"), 1)
+
+        cache.put("c", 3)
+
+        with self.subTest("Least recently used evicted"):
+            self.assertEqual(list(cache), ["a", "c"])
+
+        with self.subTest("Missing key"):
+            self.assertIsNone(cache.get("b"))
+
+    def test_pop(self):
+        cache: LRUCache[str, int] = LRUCache(maxsize=2)
+        cache.put("a", 1)
+
+        with self.subTest("Pop"):
+            self.assertEqual(cache.pop("a"), 1)
+
+        with self.subTest("Gone"):
+            self.assertNotIn("a", cache)
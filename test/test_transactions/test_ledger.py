@@ -1,10 +1,24 @@
 import datetime
-from unittest import TestCase
+import json
+from unittest import TestCase, mock
 
 import mysql.connector
 
-from transactions.ledger import Ledger, LedgerConstructionError
-from transactions.transaction import Transaction
+from settle.flow_algorithms import NoSimplification
+from transactions import render
+from transactions.ledger import (
+    Ledger,
+    LedgerConstructionError,
+    IncrementalState,
+    incremental_states,
+    CachedSimplification,
+    simplification_cache,
+    InvalidCursor,
+    SimplificationError,
+    decode_cursor,
+    encode_cursor,
+)
+from transactions.transaction import Transaction, pair_id_cache
 
 
 def setup_db_test_rows(rows: list):
@@ -96,6 +110,21 @@ class TestLedger(TestCase):
 
         self.assertEqual(u, exp)
 
+    def test_fingerprint_house(self):
+        # connect to db
+        conn = mysql.connector.connect(
+            host="localhost", user="root", password="I_love_stew!12", database="x5db"
+        )
+
+        db = conn.cursor()
+        fingerprint, t_ids = Ledger.fingerprint_house(3, db)
+
+        with self.subTest("Transaction ids"):
+            self.assertEqual(frozenset({428, 429, 430}), t_ids)
+
+        with self.subTest("Stable"):
+            self.assertEqual(fingerprint, Ledger.fingerprint_house(3, db)[0])
+
     def test_simplify(self):
         # connect to db
         conn = mysql.connector.connect(
@@ -104,3 +133,397 @@ class TestLedger(TestCase):
 
         db = conn.cursor()
         Ledger.simplify(3, db, conn)
+
+
+def clear_caches():
+    """Empties the caches simplifying a ledger fills"""
+    simplification_cache.clear()
+    incremental_states.clear()
+    pair_id_cache.clear()
+    render.graphs.clear()
+    render.sources.clear()
+    render.svgs.clear()
+    render.latest.clear()
+
+
+class TestLedgerSimplified(TestCase):
+    def setUp(self) -> None:
+        """Ledger for the same house as TestLedger, built without the database
+
+        a owes b 10, c owes b 5, a owes c 5
+        """
+        due = datetime.date(2023, 3, 13)
+        self.ledger = Ledger(
+            [
+                Transaction(428, 5, 6, "a", "b", 10, "a->b", due, False, 3),
+                Transaction(429, 7, 6, "c", "b", 5, "c->b", due, False, 3),
+                Transaction(430, 5, 7, "a", "c", 5, "a->c", due, False, 3),
+            ]
+        )
+
+        # the household's unpaid transactions are the ledger's, in place of the database
+        self.fingerprint = mock.patch.object(
+            Ledger,
+            "fingerprint_house",
+            return_value=("abc", frozenset({428, 429, 430})),
+        )
+        self.build = mock.patch.object(
+            Ledger, "build_from_house_id", return_value=self.ledger
+        )
+
+        # writing the greedy simplification (a owes b 15) finds pair 12 and adds transaction 900
+        self.cur, self.conn = mock.MagicMock(), mock.MagicMock()
+        self.cur.fetchall.side_effect = [[(12, 5, 6)], [(900, 12, 15)]]
+        self.cur.lastrowid, self.cur.rowcount = 900, 1
+
+        # simplifying fills module level caches; they are emptied however the test ends
+        clear_caches()
+        self.addCleanup(clear_caches)
+
+    def test_balances(self):
+        exp = {(5, "a"): -15, (6, "b"): 15, (7, "c"): 0}
+        self.assertEqual(exp, self.ledger.balances)
+
+    def test_balances_json(self):
+        """Reported in user id order, the same whether or not they are worked out with numpy"""
+        exp = [
+            {"user_id": 5, "name": "a", "balance": -15},
+            {"user_id": 6, "name": "b", "balance": 15},
+            {"user_id": 7, "name": "c", "balance": 0},
+        ]
+
+        for threshold in [len(self.ledger.transactions) + 1, 0]:
+            with self.subTest(vectorised=threshold == 0), mock.patch(
+                "transactions.ledger.VECTORISE_MIN_TRANSACTIONS", threshold
+            ):
+                self.assertEqual(exp, json.loads(self.ledger.balances_json))
+
+    def test_simplified(self):
+        """Both methods keep everyone's balance the same; greedy also gives the smallest settlement"""
+
+        for method in ["max_flow", "greedy"]:
+            try:
+                simplified = self.ledger.simplified(method)
+            except NoSimplification:
+                continue
+
+            edges = [
+                (u.v_id, e.target.v_id, e.capacity)
+                for u, es in simplified.graph.items()
+                for e in es
+                if not e.residual
+            ]
+
+            balances = {5: 0, 6: 0, 7: 0}
+            for src, dest, amount in edges:
+                balances[src] -= amount
+                balances[dest] += amount
+
+            with self.subTest(f"{method} balances"):
+                self.assertEqual({5: -15, 6: 15, 7: 0}, balances)
+
+            if method == "greedy":
+                with self.subTest("greedy edges"):
+                    self.assertEqual([(5, 6, 15)], edges)
+
+    def test_simplified_greedy_no_simplification(self):
+        ledger = Ledger(self.ledger.transactions[:1])
+
+        with self.assertRaises(NoSimplification):
+            ledger.simplified("greedy")
+
+    def test_fold_in(self):
+        """Folding in b owes a 15 cancels the household's debts out"""
+        incremental_states.put(
+            3, IncrementalState.build({428, 429, 430}, self.ledger.simplified("greedy"))
+        )
+
+        due = datetime.date(2023, 3, 13)
+        Ledger.fold_in(Transaction(431, 6, 5, "b", "a", 15, "b->a", due, False, 3))
+
+        state = incremental_states.pop(3)
+
+        with self.subTest("Transaction recorded"):
+            self.assertEqual({428, 429, 430, 431}, state.t_ids)
+
+        with self.subTest("Debts cancelled"):
+            self.assertEqual(frozenset(), state.settle.graph.fingerprint())
+
+    def test_simplified_mutual_debts(self):
+        """b owes a 4 back; a owes b 6 once netted"""
+        due = datetime.date(2023, 3, 13)
+        ledger = Ledger(
+            [
+                Transaction(428, 5, 6, "a", "b", 10, "a->b", due, False, 3),
+                Transaction(431, 6, 5, "b", "a", 4, "b->a", due, False, 3),
+            ]
+        )
+
+        with self.subTest("Debt graph"):
+            self.assertEqual(frozenset({(5, 6, 6)}), ledger.debt_graph().fingerprint())
+
+        with self.subTest("Simplified"):
+            self.assertEqual(frozenset({(5, 6, 6)}), ledger.simplified().fingerprint())
+
+    def test_vectorised(self):
+        """Large ledgers work out balances and net debts with numpy, and get the same answers as small ones"""
+        due = datetime.date(2023, 3, 13)
+        names = {5: "a", 6: "b", 7: "c", 8: "d"}
+        debts = [
+            (5, 6, 10),
+            (6, 5, 4),
+            (7, 6, 5),
+            (5, 7, 5),
+            (8, 8, 3),
+            (6, 8, 2),
+            (8, 6, 2),
+            (7, 8, 1),
+        ]
+        ledger = Ledger(
+            [
+                Transaction(
+                    400 + i,
+                    src,
+                    dest,
+                    names[src],
+                    names[dest],
+                    amount,
+                    "",
+                    due,
+                    False,
+                    3,
+                )
+                for i, (src, dest, amount) in enumerate(debts * 3)
+            ]
+        )
+
+        with mock.patch(
+            "transactions.ledger.VECTORISE_MIN_TRANSACTIONS",
+            len(ledger.transactions) + 1,
+        ):
+            balances, debt = ledger.balances, ledger.debt_graph().fingerprint()
+
+        with mock.patch("transactions.ledger.VECTORISE_MIN_TRANSACTIONS", 0):
+            with self.subTest("Balances"):
+                self.assertEqual(balances, ledger.balances)
+
+            with self.subTest("Debt graph"):
+                self.assertEqual(
+                    frozenset({(5, 6, 18), (7, 6, 15), (5, 7, 15), (7, 8, 3)}), debt
+                )
+                self.assertEqual(debt, ledger.debt_graph().fingerprint())
+
+            with self.subTest("Users"):
+                self.assertEqual(sorted(ledger.users), ledger.arrays()[0])
+
+    def test_invalidate(self):
+        simplification_cache.put(
+            (3, "max_flow", "a"), CachedSimplification(frozenset({428}), None)
+        )
+        simplification_cache.put(
+            (4, "max_flow", "b"), CachedSimplification(frozenset({500}), None)
+        )
+
+        with self.subTest("By transaction"):
+            Ledger.invalidate(t_id=428)
+            self.assertEqual([(4, "max_flow", "b")], list(simplification_cache))
+
+        with self.subTest("By household"):
+            Ledger.invalidate(house_id=4)
+            self.assertEqual([], list(simplification_cache))
+
+    def test_build_from_house_id_one_query(self):
+        """The whole ledger comes from one joined query; the household is only looked up when it is empty"""
+        due = datetime.date(2023, 3, 13)
+        cur = mock.MagicMock()
+        cur.fetchall.return_value = [
+            (428, 5, 6, "a", "b", 10, "a->b", due, 0, 3),
+            (429, 7, 6, "c", "b", 5, "c->b", due, 0, 3),
+            (430, 5, 7, "a", "c", 5, "a->c", due, 0, 3),
+        ]
+
+        with self.subTest("One query"):
+            self.assertEqual(
+                self.ledger.transactions,
+                Ledger.build_from_house_id(3, cur).transactions,
+            )
+            self.assertEqual(1, cur.execute.call_count)
+
+        cur.reset_mock()
+        cur.fetchall.return_value = []
+
+        with self.subTest("Household doesn't exist"), self.assertRaises(
+            LedgerConstructionError
+        ):
+            Ledger.build_from_house_id(-1, cur)
+
+        with self.subTest("User doesn't exist"), self.assertRaises(
+            LedgerConstructionError
+        ):
+            Ledger.build_from_user_id(-1, cur)
+
+    def test_page(self):
+        """Pages are cut in SQL, and the cursor of a page picks up after its last transaction"""
+        due = datetime.date(2023, 3, 13)
+        cur = mock.MagicMock()
+        cur.fetchall.return_value = [
+            (428, 5, 6, "a", "b", 10, "a->b", due, 0, 3),
+            (430, 5, 7, "a", "c", 5, "a->c", due, 0, 3),
+            (431, 6, 5, "b", "a", 4, "b->a", due, 0, 3),
+        ]
+
+        page = Ledger.page(5, cur, paid=False, limit=2)
+        query, params = cur.execute.call_args.args
+
+        with self.subTest("Page"):
+            self.assertEqual([428, 430], [t.t_id for t in page.ledger.transactions])
+
+        with self.subTest("Query"):
+            self.assertIn("ORDER BY due_date, transaction.id LIMIT %s", query)
+            self.assertEqual([5, 5, 0, 3], params)
+
+        with self.subTest("Next cursor"):
+            self.assertEqual((due, 430), decode_cursor(page.next_cursor))
+
+        cur.fetchall.return_value = cur.fetchall.return_value[2:]
+        page = Ledger.page(5, cur, after=page.next_cursor, limit=2)
+
+        with self.subTest("Keyset"):
+            self.assertEqual([5, 5, due, due, 430, 3], cur.execute.call_args.args[1])
+
+        with self.subTest("Last page"):
+            self.assertEqual([431], [t.t_id for t in page.ledger.transactions])
+            self.assertIsNone(page.next_cursor)
+
+        with self.subTest("Invalid cursor"), self.assertRaises(InvalidCursor):
+            Ledger.page(5, cur, after="not a cursor")
+
+    def test_stream(self):
+        """Transactions are read a batch at a time, and come out as one JSON list of objects"""
+        due = datetime.date(2023, 3, 13)
+        rows = iter(
+            [(t_id, 5, 6, "a", "b", 10, "a->b", due, 0, 3) for t_id in range(1, 6)]
+        )
+        cur = mock.MagicMock()
+        cur.fetchmany.side_effect = lambda size: [
+            row for _, row in zip(range(size), rows)
+        ]
+
+        with mock.patch("transactions.ledger.STREAM_BATCH", 2):
+            transactions = Ledger.stream(5, cur, paid=False)
+
+            with self.subTest("Query run up front"):
+                self.assertEqual(1, cur.execute.call_count)
+                self.assertEqual(1, cur.fetchmany.call_count)
+
+            body = "".join(Ledger.json_chunks(transactions))
+
+        with self.subTest("JSON"):
+            self.assertEqual(
+                list(range(1, 6)), [t["transaction_id"] for t in json.loads(body)]
+            )
+
+        with self.subTest("Read in batches"):
+            self.assertEqual(4, cur.fetchmany.call_count)
+
+        with self.subTest("Nothing to stream"):
+            self.assertEqual([], json.loads("".join(Ledger.json_chunks([]))))
+
+    def test_simplify_writes_once(self):
+        """The simplified transactions are written with a few bulk queries and one commit, or not at all"""
+        cur, conn = self.cur, self.conn
+
+        with self.fingerprint, self.build:
+            Ledger.simplify(3, cur, conn, "greedy", incremental=True)
+
+        with self.subTest("Inserted together"):
+            self.assertEqual(1, cur.executemany.call_count)
+            self.assertEqual(
+                [(12, 15, "Simplified Transaction")],
+                [r[:3] for r in cur.executemany.call_args.args[1]],
+            )
+
+        with self.subTest("Deleted together"):
+            self.assertEqual(
+                ("DELETE FROM transaction WHERE id IN (%s, %s, %s)", [428, 429, 430]),
+                cur.execute.call_args.args,
+            )
+
+        with self.subTest("Committed once"):
+            self.assertEqual(1, conn.commit.call_count)
+
+        with self.subTest("New ids"):
+            self.assertEqual({900}, incremental_states.get(3).t_ids)
+
+        with self.subTest("Graph recorded"):
+            self.assertIn(3, render.latest)
+
+        clear_caches()
+        cur.reset_mock(), conn.reset_mock()
+        cur.fetchall.side_effect = [[(12, 5, 6)]]
+        cur.executemany.side_effect = mysql.connector.Error("insert failed")
+
+        with self.fingerprint, self.build, self.assertRaises(SimplificationError):
+            Ledger.simplify(3, cur, conn, "greedy")
+
+        with self.subTest("Rolled back"):
+            self.assertEqual(0, conn.commit.call_count)
+            self.assertEqual(1, conn.rollback.call_count)
+            self.assertNotIn(3, render.latest)
+
+    def test_simplify_render_unchanged_by_fold_in(self):
+        """The graph kept for rendering is a copy, so folding in later transactions doesn't change it"""
+        with self.fingerprint, self.build:
+            Ledger.simplify(3, self.cur, self.conn, "greedy", incremental=True)
+
+        key = render.latest.get(3)
+        source = render.dot_source(key)
+        render.sources.clear()
+
+        due = datetime.date(2023, 3, 13)
+        Ledger.fold_in(Transaction(431, 6, 5, "b", "a", 15, "b->a", due, False, 3))
+
+        with self.subTest("Graph folded into"):
+            self.assertEqual(
+                frozenset(), incremental_states.get(3).settle.graph.fingerprint()
+            )
+
+        with self.subTest("Rendered graph unchanged"):
+            self.assertEqual(key, render.graph_hash(render.graphs.get(key)))
+            self.assertEqual(source, render.dot_source(key))
+
+    def test_cursor(self):
+        due = datetime.date(2023, 3, 13)
+        self.assertEqual((due, 1234), decode_cursor(encode_cursor(due, 1234)))
+
+    def test_plan(self):
+        """A plan is worked out once, then reused from the cache until the transactions change"""
+        with self.fingerprint, self.build, mock.patch.object(
+            Ledger, "simplified", wraps=self.ledger.simplified
+        ) as simplified:
+            plan = Ledger.plan(3, None, "greedy")
+            again = Ledger.plan(3, None, "greedy")
+
+        with self.subTest("Worked out once"):
+            self.assertEqual(1, simplified.call_count)
+            self.assertIs(plan.simplified, again.simplified)
+
+        with self.subTest("JSON"):
+            self.assertEqual(
+                {
+                    "transfers": [
+                        {
+                            "src_id": 5,
+                            "dest_id": 6,
+                            "src": "a",
+                            "dest": "b",
+                            "amount": 15,
+                        }
+                    ],
+                    "before": 3,
+                    "after": 1,
+                    "reduction": 2,
+                    "partial": False,
+                },
+                json.loads(plan.json),
+            )
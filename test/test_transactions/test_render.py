@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from settle.flow import FlowGraph, Vertex, Edge
+from transactions import render
+
+
+class TestRender(TestCase):
+    def setUp(self) -> None:
+        self.a = Vertex(0, "A")
+        self.b = Vertex(1, "B")
+
+        self.graph = FlowGraph([self.a, self.b])
+        self.graph.add_edge(src=self.a, edge=Edge(self.b, 0, 10))
+
+        render.graphs.clear()
+        render.sources.clear()
+        render.svgs.clear()
+        render.latest.clear()
+
+    def test_graph_hash(self):
+        same = FlowGraph([self.a, self.b])
+        same.add_edge(src=self.a, edge=Edge(self.b, 0, 10))
+
+        different = FlowGraph([self.a, self.b])
+        different.add_edge(src=self.a, edge=Edge(self.b, 0, 5))
+
+        with self.subTest("Same graph"):
+            self.assertEqual(render.graph_hash(self.graph), render.graph_hash(same))
+
+        with self.subTest("Different graph"):
+            self.assertNotEqual(
+                render.graph_hash(self.graph), render.graph_hash(different)
+            )
+
+    def test_record(self):
+        key = render.record(3, self.graph)
+
+        with self.subTest("Latest graph"):
+            self.assertEqual(render.latest.get(3), key)
+
+        with self.subTest("Not rendered yet"):
+            self.assertNotIn(key, render.sources)
+            self.assertNotIn(key, render.svgs)
+
+        with self.subTest("DOT source made on request"):
+            source = render.dot_source(key)
+            self.assertIn("A", source)
+            self.assertIn(key, render.sources)
+
+    def test_unknown_graph(self):
+        self.assertIsNone(render.dot_source("unknown"))
+        self.assertIsNone(render.svg("unknown"))
@@ -1,5 +1,5 @@
 from typing import Any
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import mysql.connector
 
@@ -17,6 +17,11 @@ class MockPost:
 
 
 class TestTransaction(TestCase):
+    def setUp(self) -> None:
+        # pairs cached by one test mustn't be found by the next, however it ends
+        pair_id_cache.clear()
+        self.addCleanup(pair_id_cache.clear)
+
     def test_json(self):
         """Make sure json in correct format"""
 
@@ -74,6 +79,152 @@ class TestTransaction(TestCase):
             with self.assertRaises(TransactionConstructionError):
                 Transaction.build_from_id(transaction_id=-1, cur=db)
 
+    def test_from_row(self):
+        row = (
+            1,
+            1,
+            2,
+            "Alice _",
+            "Bob _",
+            10,
+            "test",
+            datetime.date(2023, 2, 17),
+            0,
+            1,
+        )
+        transaction = Transaction.from_row(row)
+
+        with self.subTest("Fields"):
+            self.assertEqual(
+                Transaction(
+                    1,
+                    1,
+                    2,
+                    "Alice _",
+                    "Bob _",
+                    10,
+                    "test",
+                    datetime.date(2023, 2, 17),
+                    False,
+                    1,
+                ),
+                transaction,
+            )
+
+        with self.subTest("Paid is a bool"):
+            self.assertIs(True, Transaction.from_row(row[:-2] + (1, 1)).paid)
+
+    def test_insert_transaction(self):
+        """The pair is added or got back in one query, then cached; ids come from lastrowid"""
+        cur, conn = mock.MagicMock(), mock.MagicMock()
+        transaction = Transaction(
+            0,
+            1,
+            2,
+            "Alice _",
+            "Bob _",
+            10,
+            "test",
+            datetime.date(2023, 2, 17),
+            False,
+            1,
+        )
+
+        cur.lastrowid = 7
+        transaction.insert_transaction(cur, conn)
+
+        with self.subTest("Uncached pair"):
+            self.assertEqual(2, cur.execute.call_count)
+            self.assertEqual(7, pair_id_cache.get((1, 2)))
+            self.assertEqual(7, transaction.t_id)
+            self.assertEqual(1, conn.commit.call_count)
+
+        cur.reset_mock()
+        cur.lastrowid = 8
+        transaction.insert_transaction(cur, conn)
+
+        with self.subTest("Cached pair"):
+            self.assertEqual(1, cur.execute.call_count)
+            self.assertEqual(7, cur.execute.call_args.args[1][0])
+            self.assertEqual(8, transaction.t_id)
+
+        with self.subTest("Forgotten with the user"):
+            forget_pairs(2)
+            self.assertNotIn((1, 2), pair_id_cache)
+
+        # mysql-connector reports no id as 0
+        cur.reset_mock(), conn.reset_mock()
+        cur.lastrowid = 0
+
+        with self.subTest("Pair not added"), self.assertRaises(
+            TransactionInsertionFailed
+        ):
+            transaction.insert_transaction(cur, conn)
+
+        with self.subTest("Rolled back"):
+            self.assertEqual(1, cur.execute.call_count)
+            self.assertEqual(1, conn.rollback.call_count)
+
+    def test_pair_ids(self):
+        pair_id_cache.put((1, 2), 7)
+
+        cur = mock.MagicMock()
+        cur.fetchall.side_effect = [[(8, 2, 1)], [(9, 3, 1)]]
+
+        ids = pair_ids(cur, {(1, 2), (2, 1), (3, 1)})
+
+        with self.subTest("Ids"):
+            self.assertEqual({(1, 2): 7, (2, 1): 8, (3, 1): 9}, ids)
+
+        with self.subTest("Missing pairs added together"):
+            self.assertEqual([(3, 1)], cur.executemany.call_args.args[1])
+            self.assertNotIn("IGNORE", cur.executemany.call_args.args[0])
+
+        with self.subTest("Only committed pairs cached"):
+            self.assertEqual(8, pair_id_cache.get((2, 1)))
+            self.assertNotIn((3, 1), pair_id_cache)
+
+        # the pair wasn't added, so isn't found after adding it either
+        cur.fetchall.side_effect = [[], []]
+
+        with self.subTest("Pair not added"), self.assertRaises(mysql.connector.Error):
+            pair_ids(cur, {(4, 1)})
+
+    def test_replace_transactions(self):
+        """New ids are read back, not assumed to follow on from the first"""
+        pair_id_cache.put((1, 2), 7)
+        pair_id_cache.put((2, 1), 8)
+
+        due = datetime.date(2023, 3, 13)
+        new = [
+            Transaction(0, 1, 2, "a", "b", 5, "a->b", due, False, 3),
+            Transaction(0, 2, 1, "b", "a", 5, "b->a", due, False, 3),
+            Transaction(0, 1, 2, "a", "b", 5, "a->b", due, False, 3),
+        ]
+
+        cur = mock.MagicMock()
+        cur.lastrowid, cur.rowcount = 20, 3
+        cur.fetchall.return_value = [(20, 7, 5), (22, 8, 5), (25, 7, 5)]
+
+        replace_transactions(cur, [1, 2], new)
+
+        with self.subTest("Ids"):
+            self.assertEqual([20, 22, 25], [t.t_id for t in new])
+
+        with self.subTest("Ids read back"):
+            self.assertEqual([20, 20, 2, 7, 8], cur.execute.call_args_list[0].args[1])
+
+        cur.rowcount = 2
+
+        with self.subTest("Not all added"), self.assertRaises(mysql.connector.Error):
+            replace_transactions(cur, [1, 2], new)
+
+        # mysql-connector reports no id as 0
+        cur.lastrowid, cur.rowcount = 0, 3
+
+        with self.subTest("No id"), self.assertRaises(mysql.connector.Error):
+            replace_transactions(cur, [1, 2], new)
+
     def test_build_from_req(self):
         # connect to db
         conn = mysql.connector.connect(
@@ -0,0 +1,362 @@
+"""Simplifies the ledgers of many households in one go, e.g. as a nightly job.
+
+    python -m transactions.batch                              # every household with unpaid transactions
+    python -m transactions.batch --houses 1 2 3 --workers 4 --method greedy
+
+Rather than one /simplify request (and one full ledger load) per household, unpaid transactions are loaded with a few
+bulk queries, simplified in a pool of processes and written back a batch of households per database transaction.
+"""
+from __future__ import annotations
+
+import argparse
+import getpass
+import logging
+import os
+import sys
+import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import mysql.connector
+from mysql.connector import cursor, MySQLConnection
+
+from settle.flow_algorithms import NoSimplification
+from transactions.ledger import Ledger, SIMPLIFY_METHODS
+from transactions.transaction import (
+    SELECT_TRANSACTIONS,
+    Transaction,
+    replace_transactions,
+)
+
+logger = logging.getLogger(__name__)
+
+# households per bulk query, and per database transaction when writing back
+LOAD_CHUNK = 500
+WRITE_BATCH = 50
+
+# how often progress is reported, in households
+PROGRESS_EVERY = 100
+
+UNPAID_TRANSACTIONS = SELECT_TRANSACTIONS + " WHERE paid = 0"
+
+
+@dataclass
+class HouseResult:
+    """Outcome of simplifying one household's ledger"""
+
+    house_id: int
+    t_ids: list[int]
+
+    # Ledger.fingerprint of the transactions as they were loaded; they aren't replaced if they have changed since
+    fingerprint: str
+
+    # (src id, src name, dest id, dest name, amount) of the new transactions; None where nothing could be simplified
+    transfers: list[tuple[int, str, int, str, int]] | None
+    seconds: float
+
+
+@dataclass
+class BatchStats:
+    households: int = 0
+    simplified: int = 0
+    unchanged: int = 0
+    failed: int = 0
+
+    # simplified, but not written as the household's transactions changed in the meantime
+    changed: int = 0
+    transactions_before: int = 0
+    transactions_after: int = 0
+
+    # seconds spent in each stage; simplifying overlaps with writing when there is a pool
+    timings: dict[str, float] = field(
+        default_factory=lambda: {"load": 0.0, "simplify": 0.0, "write": 0.0}
+    )
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def __str__(self) -> str:
+        rate = self.households / self.elapsed if self.elapsed else 0
+        return (
+            f"{self.households} households in {self.elapsed:.1f}s ({rate:.1f}/s): {self.simplified} simplified, "
+            f"{self.unchanged} unchanged, {self.failed} failed, "
+            f"{self.changed} changed while simplifying; "
+            f"{self.transactions_before} -> {self.transactions_after} transactions. "
+            + ", ".join(
+                f"{stage} {seconds:.1f}s" for stage, seconds in self.timings.items()
+            )
+        )
+
+
+def load_ledgers(
+    cur: cursor.MySQLCursor, house_ids: list[int] | None = None
+) -> dict[int, Ledger]:
+    """Returns the ledger of unpaid transactions of every household given (every household, by default), keyed by
+    household id. Loaded with one query per LOAD_CHUNK households, rather than a query per transaction
+    """
+    if house_ids is None:
+        chunks: list[list[int] | None] = [None]
+    else:
+        chunks = [
+            house_ids[i : i + LOAD_CHUNK] for i in range(0, len(house_ids), LOAD_CHUNK)
+        ]
+
+    ledgers: dict[int, Ledger] = {}
+    for chunk in chunks:
+        if chunk is None:
+            cur.execute(UNPAID_TRANSACTIONS + " ORDER BY transaction.id")
+        else:
+            cur.execute(
+                UNPAID_TRANSACTIONS
+                + f" AND u1.household_id IN ({', '.join(['%s'] * len(chunk))}) ORDER BY transaction.id",
+                chunk,
+            )
+
+        for row in cur.fetchall():
+            transaction = Transaction.from_row(row)
+            ledgers.setdefault(transaction.house_id, Ledger([])).transactions.append(
+                transaction
+            )
+
+    return ledgers
+
+
+def simplify_house(
+    house_id: int, ledger: Ledger, method: str = "max_flow"
+) -> HouseResult:
+    """Simplifies one household's ledger. Lives at module level so it can be sent to worker processes"""
+    start = time.perf_counter()
+    t_ids = [t.t_id for t in ledger.transactions]
+    fingerprint = ledger.fingerprint
+
+    try:
+        simplified = ledger.simplified(method)
+    except NoSimplification:
+        return HouseResult(
+            house_id, t_ids, fingerprint, None, time.perf_counter() - start
+        )
+
+    transfers = [
+        (node.v_id, node.label, edge.target.v_id, edge.target.label, edge.capacity)
+        for node, edges in simplified.graph.items()
+        for edge in edges
+        if not edge.residual
+    ]
+
+    return HouseResult(
+        house_id, t_ids, fingerprint, transfers, time.perf_counter() - start
+    )
+
+
+def simplify_all(
+    ledgers: dict[int, Ledger], method: str = "max_flow", workers: int | None = None
+) -> Iterator[HouseResult]:
+    """Yields the result of simplifying every ledger, as they finish. Ledgers are simplified in a pool of processes
+    (workers limits its size; defaults to the number of CPUs). workers=1 never starts a pool
+    """
+    house_ids = list(ledgers)
+
+    if workers == 1:
+        yield from (simplify_house(h, ledgers[h], method) for h in house_ids)
+        return
+
+    # a few chunks per worker: fewer round trips to the pool, but work still evens out
+    chunksize = max(1, len(house_ids) // (4 * (workers or os.cpu_count() or 1)))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(
+            simplify_house,
+            house_ids,
+            [ledgers[h] for h in house_ids],
+            [method] * len(house_ids),
+            chunksize=chunksize,
+        )
+
+
+def lock_changed(
+    results: list[HouseResult], cur: cursor.MySQLCursor
+) -> list[HouseResult]:
+    """Locks the unpaid transactions of every household in results until the end of the database transaction, and
+    returns the results of the households whose unpaid transactions have changed since they were loaded
+    (paid, edited, added or deleted), which can't be written"""
+    house_ids = [r.house_id for r in results]
+    cur.execute(
+        "SELECT u.household_id, transaction.id, p.src, p.dest, amount FROM transaction "
+        "INNER JOIN pairs p ON transaction.pair_id = p.id "
+        "INNER JOIN user u ON p.src = u.id "
+        f"WHERE u.household_id IN ({', '.join(['%s'] * len(house_ids))}) AND paid = 0 "
+        "ORDER BY transaction.id FOR UPDATE OF transaction",
+        house_ids,
+    )
+
+    rows: list[tuple[int, int, int, int, int]] = cur.fetchall()  # type: ignore
+    current: dict[int, list[tuple[int, int, int, int]]] = {h: [] for h in house_ids}
+    for house_id, t_id, src, dest, amount in rows:
+        current[house_id].append((t_id, src, dest, amount))
+
+    return [
+        r
+        for r in results
+        if Ledger.fingerprint_rows(current[r.house_id]) != r.fingerprint
+    ]
+
+
+def write_results(
+    results: list[HouseResult], cur: cursor.MySQLCursor, conn: MySQLConnection
+) -> list[HouseResult]:
+    """Replaces the transactions of every simplified household in results, in one database transaction, and returns
+    the results that weren't written as the household's transactions changed since they were loaded (see
+    lock_changed). Either every other household in the batch is written, or (on an error) none are
+    """
+    results = [r for r in results if r.transfers is not None]
+    if not results:
+        return []
+
+    due = (datetime.today() + timedelta(days=7)).date()
+
+    try:
+        # checked inside the write's database transaction, so nothing can change between checking and writing
+        changed = lock_changed(results, cur)
+        results = [r for r in results if r not in changed]
+
+        new = [
+            Transaction(
+                0,
+                src,
+                dest,
+                src_name,
+                dest_name,
+                amount,
+                "Simplified Transaction",
+                due,
+                False,
+                r.house_id,
+            )
+            for r in results
+            for src, src_name, dest, dest_name, amount in r.transfers  # type: ignore
+        ]
+
+        if new:
+            replace_transactions(cur, [t_id for r in results for t_id in r.t_ids], new)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+
+    for r in changed:
+        logger.warning(
+            f"Household {r.house_id} changed while it was being simplified; not written"
+        )
+
+    return changed
+
+
+def run(
+    cur: cursor.MySQLCursor,
+    conn: MySQLConnection,
+    house_ids: list[int] | None = None,
+    method: str = "max_flow",
+    workers: int | None = None,
+    dry_run: bool = False,
+    progress=None,
+) -> BatchStats:
+    """Simplifies every household given (every household with unpaid transactions, by default).
+    Writes nothing with dry_run set. Progress is printed to progress, if given"""
+    stats = BatchStats()
+
+    start = time.perf_counter()
+    ledgers = load_ledgers(cur, house_ids)
+    stats.timings["load"] += time.perf_counter() - start
+
+    pending: list[HouseResult] = []
+
+    def flush():
+        start = time.perf_counter()
+        try:
+            unwritten = write_results(pending, cur, conn) if not dry_run else []
+            stats.changed += len(unwritten)
+        except mysql.connector.Error as e:
+            logger.error(f"Failed to write {len(pending)} households: {e}")
+            unwritten = [r for r in pending if r.transfers is not None]
+            stats.failed += len(unwritten)
+
+        # households that weren't written keep their old transactions
+        stats.simplified -= len(unwritten)
+        for r in unwritten:
+            stats.transactions_after += len(r.t_ids) - len(r.transfers or [])
+
+        stats.timings["write"] += time.perf_counter() - start
+        pending.clear()
+
+    for result in simplify_all(ledgers, method, workers):
+        stats.households += 1
+        stats.timings["simplify"] += result.seconds
+        stats.transactions_before += len(result.t_ids)
+
+        if result.transfers is None:
+            stats.unchanged += 1
+            stats.transactions_after += len(result.t_ids)
+        else:
+            stats.simplified += 1
+            stats.transactions_after += len(result.transfers)
+
+        pending.append(result)
+        if len(pending) >= WRITE_BATCH:
+            flush()
+
+        if progress and stats.households % PROGRESS_EVERY == 0:
+            print(f"{stats.households}/{len(ledgers)} ... {stats}", file=progress)
+
+    flush()
+
+    return stats
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--houses", nargs="+", type=int, help="household ids (default: every household)"
+    )
+    parser.add_argument("--method", choices=SIMPLIFY_METHODS, default="max_flow")
+    parser.add_argument(
+        "--workers", type=int, help="size of the process pool (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="simplify, but don't write anything"
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--database", default="x5db")
+    args = parser.parse_args(argv)
+
+    password = os.environ.get("X5DB_PASSWORD") or getpass.getpass("Database password: ")
+    conn: MySQLConnection = mysql.connector.connect(  # type: ignore
+        host=args.host, user=args.user, password=password, database=args.database
+    )
+
+    try:
+        stats = run(
+            conn.cursor(),
+            conn,
+            args.houses,
+            args.method,
+            args.workers,
+            args.dry_run,
+            sys.stderr,
+        )
+    finally:
+        conn.close()
+
+    print(stats)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""In-process caches shared between requests"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Generic, Hashable, Iterator, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Map holding at most maxsize items; the least recently used item is evicted first.
+    Safe to share between the server's threads"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        """Returns the item stored under key (marking it as recently used), or default if there isn't one"""
+        with self._lock:
+            if key not in self._items:
+                return default
+
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: K, value: V):
+        """Stores value under key, evicting the least recently used item if the cache is full"""
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key: K, default: V | None = None) -> V | None:
+        """Removes and returns the item stored under key"""
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def items(self) -> list[tuple[K, V]]:
+        """Returns a snapshot of the cached items, without marking them as used"""
+        with self._lock:
+            return list(self._items.items())
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[K]:
+        with self._lock:
+            return iter(list(self._items))
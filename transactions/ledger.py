@@ -1,18 +1,29 @@
 from __future__ import annotations
 
+import base64
+import binascii
+import hashlib
 import json
 import logging
 import sys
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+import threading
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
 
+import mysql.connector
+import numpy as np
 from mysql.connector import cursor, MySQLConnection
 
 from settle import flow, flow_algorithms
+from settle.incremental import IncrementalSettle
+from transactions import render, vectorised
+from transactions.cache import LRUCache
 from transactions.transaction import (
+    SELECT_TRANSACTIONS,
     Transaction,
-    TransactionInsertionFailed,
     CalendarEvent,
+    replace_transactions,
 )
 
 # initialise logger
@@ -32,6 +43,151 @@ class EmptyLedger(Exception):
     ...
 
 
+class InvalidCursor(Exception):
+    """Page cursor wasn't one given out with a page of a ledger"""
+
+
+# ways a ledger can be simplified; see Ledger.simplified
+SIMPLIFY_METHODS = ("max_flow", "greedy")
+
+# ledgers with at least this many transactions work out balances and net debts with numpy (see
+# transactions.vectorised); below it, setting up the arrays costs more than looping over the transactions
+VECTORISE_MIN_TRANSACTIONS = 128
+
+# transactions in a page of a user's ledger (see Ledger.page), unless fewer are asked for; at most MAX_PAGE_SIZE
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# rows read from the database at a time when streaming a ledger (see Ledger.stream)
+STREAM_BATCH = 200
+
+
+def encode_cursor(due: date, t_id: int) -> str:
+    """Returns an opaque token for the position just after the transaction (due, t_id) in a ledger ordered by due
+    date, then id"""
+    return (
+        base64.urlsafe_b64encode(f"{due.isoformat()},{t_id}".encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_cursor(token: str) -> tuple[date, int]:
+    """Reverse of encode_cursor. Raises InvalidCursor for anything encode_cursor couldn't have made"""
+    try:
+        due, t_id = (
+            base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            .decode()
+            .split(",")
+        )
+        return date.fromisoformat(due), int(t_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(token) from e
+
+
+@dataclass
+class IncrementalState:
+    """Simplified debt graph of a household's unpaid transactions, kept up to date as transactions are added"""
+
+    t_ids: set[int]
+    settle: IncrementalSettle
+    vertices: dict[int, flow.Vertex]
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    @staticmethod
+    def build(t_ids: set[int], graph: flow.FlowGraph) -> IncrementalState:
+        return IncrementalState(
+            t_ids, IncrementalSettle(graph), {v.v_id: v for v in graph.graph.keys()}
+        )
+
+
+# household id -> incrementally simplified graph; only kept for households simplified with incremental=True
+incremental_states: LRUCache[int, IncrementalState] = LRUCache(maxsize=256)
+
+
+@dataclass
+class CachedSimplification:
+    """Outcome of simplifying a household's unpaid transactions"""
+
+    t_ids: frozenset[int]
+
+    # None where no simplification could be made
+    simplified: flow.FlowGraph | None
+
+    # simplifying ran out of budget; only cached for previews (see Ledger.plan)
+    partial: bool = False
+
+
+# (household id, method, fingerprint of unpaid transactions) -> outcome of simplifying them
+simplification_cache: LRUCache[tuple[int, str, str], CachedSimplification] = LRUCache(
+    maxsize=512
+)
+
+
+@dataclass
+class SimplificationPlan:
+    """How a household's unpaid transactions would be simplified; see Ledger.plan"""
+
+    ledger: Ledger
+    simplified: flow.FlowGraph
+
+    # key of the plan in simplification_cache
+    key: tuple[int, str, str]
+
+    partial: bool = False
+
+    @property
+    def transfers(self) -> list[tuple[flow.Vertex, flow.Vertex, int]]:
+        """Returns the (src, dest, amount) of every transaction the ledger would be replaced with"""
+        return [
+            (node, edge.target, edge.capacity)
+            for node, edges in self.simplified.graph.items()
+            for edge in edges
+            if not edge.residual
+        ]
+
+    @property
+    def json(self) -> str:
+        """Returns a JSON representation of the plan of the format
+
+        {   "transfers": [{"src_id": <int>, "dest_id": <int>, "src": <str>, "dest": <str>, "amount": <int>}, ...],
+            "before": <int: number of transactions now>,
+            "after": <int: number of transactions once simplified>,
+            "reduction": <int: before - after>,
+            "partial": <bool: simplifying ran out of time, so there may be a simpler plan>
+        }
+        """
+        transfers = self.transfers
+        return json.dumps(
+            {
+                "transfers": [
+                    {
+                        "src_id": src.v_id,
+                        "dest_id": dest.v_id,
+                        "src": src.label,
+                        "dest": dest.label,
+                        "amount": amount,
+                    }
+                    for src, dest, amount in transfers
+                ],
+                "before": len(self.ledger.transactions),
+                "after": len(transfers),
+                "reduction": len(self.ledger.transactions) - len(transfers),
+                "partial": self.partial,
+            }
+        )
+
+
+@dataclass
+class LedgerPage:
+    """One page of a user's ledger; see Ledger.page"""
+
+    ledger: Ledger
+
+    # pass as after to get the next page; None on the last page
+    next_cursor: str | None
+
+
 @dataclass
 class Ledger:
     """List of transaction_resources. In JSON:
@@ -43,80 +199,207 @@ class Ledger:
     @staticmethod
     def build_from_user_id(user_id: int, cur: cursor.MySQLCursor) -> Ledger:
         """Builds a ledger of transaction_resources given a user id and a cursor to the db.
-        Returns an empty ledger where user has no transaction_resources
+        Raises EmptyLedger where user has no transaction_resources
         """
-        # validate user id; return a 404 if not found
+        ledger = Ledger.load(
+            cur, "pairs.src = %s OR pairs.dest = %s", [user_id, user_id]
+        )
 
-        cur.execute("SELECT id FROM user where id = %s;", [user_id])
-        if not cur.fetchall():
-            raise LedgerConstructionError("User not found")
+        if not ledger.transactions:
+            Ledger._empty(user_id, cur)
 
-        # get all transaction ids where the user is src or dest
-        cur.execute(
-            "SELECT transaction.id FROM transaction, pairs "
-            "WHERE pair_id = pairs.id AND (src = %s OR dest = %s)",
-            [user_id, user_id],
-        )
+        return ledger
 
-        # extract transaction ids
-        transaction_rows = cur.fetchall()
+    @staticmethod
+    def build_from_house_id(house_id: int, cur: cursor.MySQLCursor) -> Ledger:
+        """Builds a ledger of all unsettled transaction_resources in a house"""
+        ledger = Ledger.load(cur, "u1.household_id = %s AND paid = 0", [house_id])
 
-        # throw an exception if no results were returned
-        if not transaction_rows:
-            raise EmptyLedger
+        if not ledger.transactions:
+            # validate that house id exists
+            cur.execute(
+                "SELECT household.id FROM household WHERE household.id = %s", [house_id]
+            )
+            if not cur.fetchall():
+                raise LedgerConstructionError("Household not found")
 
-        transaction_ids = [
-            v for v in {tid[0] for tid in [row for row in transaction_rows]}
-        ]
+        return ledger
 
-        return Ledger(
-            [
-                Transaction.build_from_id(transaction_id=t_id, cur=cur)
-                for t_id in transaction_ids
-            ]
+    @staticmethod
+    def page(
+        user_id: int,
+        cur: cursor.MySQLCursor,
+        paid: bool | None = None,
+        counterparty: int | None = None,
+        due_from: date | None = None,
+        due_to: date | None = None,
+        after: str | None = None,
+        limit: int = PAGE_SIZE,
+    ) -> LedgerPage:
+        """Returns up to limit of a user's transactions, ordered by due date then id, starting after the cursor
+        after (from the previous page's next_cursor). Only paid or unpaid transactions are given if paid is set,
+        only those with the user counterparty if it is set, and only those due between due_from and due_to
+        (inclusive) where they are set. Filtering, ordering and paging are all done in the one query.
+
+        Raises LedgerConstructionError if the user doesn't exist, and EmptyLedger if the first page is empty
+        """
+        where, params = Ledger._user_filter(
+            user_id, paid, counterparty, due_from, due_to, after
         )
 
-    @staticmethod
-    def build_from_house_id(house_id: int, cur: cursor.MySQLCursor) -> Ledger:
-        """Builds a ledger of all unsettled transaction_resources in a house"""
+        # one more than the page holds, to tell if there is a next page
+        ledger = Ledger.load(cur, where, params, "due_date, transaction.id", limit + 1)
+
+        if not ledger.transactions and after is None:
+            Ledger._empty(user_id, cur)
 
-        # validate that house id exists
+        next_cursor = None
+        if len(ledger.transactions) > limit:
+            del ledger.transactions[limit:]
+            last = ledger.transactions[-1]
+            next_cursor = encode_cursor(last.due, last.t_id)
+
+        return LedgerPage(ledger, next_cursor)
+
+    @staticmethod
+    def stream(
+        user_id: int,
+        cur: cursor.MySQLCursor,
+        paid: bool | None = None,
+        counterparty: int | None = None,
+        due_from: date | None = None,
+        due_to: date | None = None,
+        after: str | None = None,
+    ) -> Iterator[Transaction]:
+        """Yields every one of a user's transactions matching the filters (see page), with no page limit. Rows are
+        read from the cursor STREAM_BATCH at a time and built into transactions as they are yielded, so memory
+        doesn't grow with the ledger. The cursor needs to be unbuffered, and left alone until this is finished.
+
+        The query is run, and LedgerConstructionError and EmptyLedger raised, before this returns
+        """
+        where, params = Ledger._user_filter(
+            user_id, paid, counterparty, due_from, due_to, after
+        )
         cur.execute(
-            "SELECT household.id FROM household WHERE household.id = %s", [house_id]
+            f"{SELECT_TRANSACTIONS} WHERE {where} ORDER BY due_date, transaction.id",
+            params,
         )
 
+        if not (rows := cur.fetchmany(STREAM_BATCH)) and after is None:
+            Ledger._empty(user_id, cur)
+
+        def transactions(rows: list[tuple]) -> Iterator[Transaction]:
+            while rows:
+                yield from map(Transaction.from_row, rows)
+                rows = cur.fetchmany(STREAM_BATCH)
+
+        return transactions(rows)
+
+    @staticmethod
+    def _user_filter(
+        user_id: int,
+        paid: bool | None,
+        counterparty: int | None,
+        due_from: date | None,
+        due_to: date | None,
+        after: str | None,
+    ) -> tuple[str, list]:
+        """Returns the WHERE clause, and its parameters, for a user's transactions filtered as in page"""
+        conditions = ["(pairs.src = %s OR pairs.dest = %s)"]
+        params: list[object] = [user_id, user_id]
+
+        if paid is not None:
+            conditions.append("paid = %s")
+            params.append(int(paid))
+
+        if counterparty is not None:
+            conditions.append("(pairs.src = %s OR pairs.dest = %s)")
+            params += [counterparty, counterparty]
+
+        if due_from is not None:
+            conditions.append("due_date >= %s")
+            params.append(due_from)
+
+        if due_to is not None:
+            conditions.append("due_date <= %s")
+            params.append(due_to)
+
+        # keyset: carry on from the last transaction of the previous page, however many pages in
+        if after is not None:
+            due, t_id = decode_cursor(after)
+            conditions.append(
+                "(due_date > %s OR (due_date = %s AND transaction.id > %s))"
+            )
+            params += [due, due, t_id]
+
+        return " AND ".join(conditions), params
+
+    @staticmethod
+    def _empty(user_id: int, cur: cursor.MySQLCursor):
+        """Raises LedgerConstructionError if the user doesn't exist, and EmptyLedger if they do; for when none of a
+        user's transactions were found"""
+        cur.execute("SELECT id FROM user where id = %s;", [user_id])
         if not cur.fetchall():
-            raise LedgerConstructionError("Household not found")
+            raise LedgerConstructionError("User not found")
 
-        # get all unpaid transaction ids for the given household
-        cur.execute(
-            "SELECT transaction.id FROM transaction "
-            "INNER JOIN pairs p on transaction.pair_id = p.id "
-            "INNER JOIN user u on p.src = u.id "
-            "INNER JOIN household h on h.id = u.household_id "
-            "WHERE h.id = %s "
-            "AND paid = 0;",
-            [house_id],
-        )
+        raise EmptyLedger
 
-        transaction_rows = cur.fetchall()
+    @staticmethod
+    def load(
+        cur: cursor.MySQLCursor,
+        where: str,
+        params: list,
+        order: str = "transaction.id",
+        limit: int | None = None,
+    ) -> Ledger:
+        """Builds a ledger of the transactions matching the WHERE clause, ordered by id unless order is given. One
+        joined query for the whole ledger, with both users' names and the household in every row
+        """
+        query = f"{SELECT_TRANSACTIONS} WHERE {where} ORDER BY {order}"
+        if limit is not None:
+            query += " LIMIT %s"
+            params = params + [limit]
 
-        transaction_ids = [
-            v for v in {tid[0] for tid in [row for row in transaction_rows]}
-        ]
+        cur.execute(query, params)
 
-        return Ledger(
-            [
-                Transaction.build_from_id(transaction_id=t_id, cur=cur)
-                for t_id in transaction_ids
-            ]
-        )
+        return Ledger([Transaction.from_row(row) for row in cur.fetchall()])
 
     @property
     def json(self):
         """Returns json; list of transaction_resources"""
         return json.dumps([t.json for t in self.transactions])
 
+    @staticmethod
+    def json_chunks(transactions: Iterable[Transaction]) -> Iterator[str]:
+        """Yields a JSON list of the transactions, as objects rather than the strings of json, a chunk of up to
+        STREAM_BATCH transactions at a time. Only one chunk is held at once, however many transactions there are
+        """
+        yield "["
+
+        separator, chunk = "", []
+        for i, transaction in enumerate(transactions, start=1):
+            chunk.append(json.dumps(transaction.as_dict))
+            if i % STREAM_BATCH == 0:
+                yield separator + ", ".join(chunk)
+                separator, chunk = ", ", []
+
+        if chunk:
+            yield separator + ", ".join(chunk)
+
+        yield "]"
+
+    @property
+    def balances_json(self) -> str:
+        """Returns a JSON list of each user's balance (see balances), ordered by user id, of the format
+        [{"user_id": <int>, "name": <str>, "balance": <int: owed overall; negative where they owe money>}, ...]
+        """
+        return json.dumps(
+            [
+                {"user_id": u_id, "name": name, "balance": balance}
+                for (u_id, name), balance in sorted(self.balances.items())
+            ]
+        )
+
     @property
     def users(self) -> list[tuple[int, str]]:
         """Returns a list of users ids and names"""
@@ -127,56 +410,317 @@ class Ledger:
 
         return [u_ for u_ in u]
 
-    @staticmethod
-    def simplify(
-        household_id: int, cur: cursor.MySQLCursor, conn: MySQLConnection
-    ) -> None:
-        """Simplifies all unmarked transaction_resources in a group.
-
-        1. Pulls all open (i.e. unpaid) transaction_resources of a house
-        2. Converts transaction_resources into flow graph vertices
-        3. Runs simplification on the flow graph
-        4a. If no simplifications were found, report no simplifications made
-        4b. If there are simplifications to be made:
-            * Check off simplifications with a 'bookmaker' user id (some reserved u_id; arbitrary)
-            * Add new transaction_resources from the simplified model
-            * Return that transaction_resources have been updated
+    def arrays(
+        self,
+    ) -> tuple[list[tuple[int, str]], np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the ledger's users (id, name), ordered by id, and its transactions as src, dest and amount
+        arrays, where src and dest are positions in the list of users"""
+        m = len(self.transactions)
+        src, dest, amount = (
+            np.fromiter(
+                (getattr(t, field) for t in self.transactions), dtype=np.int64, count=m
+            )
+            for field in ("src_id", "dest_id", "amount")
+        )
+
+        # users are numbered by their position in the sorted ids; first tells us where each id is first seen, which
+        # is where its name comes from
+        ids, first, positions = np.unique(
+            np.concatenate((src, dest)), return_index=True, return_inverse=True
+        )
+        users = [
+            (
+                i,
+                self.transactions[f].src_name
+                if f < m
+                else self.transactions[f - m].dest_name,
+            )
+            for i, f in zip(ids.tolist(), first.tolist())
+        ]
+
+        return users, positions[:m], positions[m:], amount
+
+    @property
+    def balances(self) -> dict[tuple[int, str], int]:
+        """Returns how much each user (id, name) is owed overall; negative where they owe money"""
+        if len(self.transactions) >= VECTORISE_MIN_TRANSACTIONS:
+            users, src_pos, dest_pos, amount = self.arrays()
+            return {
+                usr: balance
+                for usr, balance in zip(
+                    users,
+                    vectorised.net_balances(
+                        src_pos, dest_pos, amount, len(users)
+                    ).tolist(),
+                )
+            }
+
+        b: dict[tuple[int, str], int] = {}
+        for transaction in self.transactions:
+            src = (transaction.src_id, transaction.src_name)
+            dest = (transaction.dest_id, transaction.dest_name)
+            b[src] = b.get(src, 0) - transaction.amount
+            b[dest] = b.get(dest, 0) + transaction.amount
+
+        return b
+
+    def simplified(
+        self, method: str = "max_flow", budget: flow_algorithms.Budget | None = None
+    ) -> flow.FlowGraph:
+        """Returns the ledger's transactions as a simplified debt graph.
+        Raises NoSimplification if no simplifications can be made.
+
+        Methods:
+            'max_flow': runs Settle.simplify_debt over the graph of transactions. If the budget runs out, the
+                graph is only partly simplified (budget.ran_out is set)
+            'greedy': settles everyone's net balance with Settle.settle_balances. At most (users - 1) transactions;
+                fast enough that the budget isn't needed
         """
+        if method not in SIMPLIFY_METHODS:
+            raise SimplificationError(f"Unknown simplification method '{method}'")
 
-        # get ledger of all unmarked transaction_resources in the house
-        ledger = Ledger.build_from_house_id(household_id, cur)
+        if method == "greedy":
+            settled = flow_algorithms.Settle.settle_balances(
+                {flow.Vertex(*usr): amount for usr, amount in self.balances.items()}
+            )
 
-        # build a map of user ids to vertices for all users in graph
-        users_vertices = {usr[0]: flow.Vertex(*usr) for usr in ledger.users}
+            # only a simplification if we end up with fewer transactions
+            if settled.edge_count() >= len(self.transactions):
+                raise flow_algorithms.NoSimplification("No simplifications were made")
 
-        # build a graph including everyone in the household
-        debt = flow.FlowGraph(vertices=[v for v in users_vertices.values()])
+            return settled
 
-        # add an edge for every transaction in the graph
-        for transaction in ledger.transactions:
-            debt.add_edge(
-                edge=flow.Edge(
-                    users_vertices[transaction.dest_id], 0, transaction.amount
-                ),
-                src=users_vertices[transaction.src_id],
+        debt = self.debt_graph()
+
+        # netting debts between the same two people already simplifies the ledger
+        netted = debt.edge_count() < len(self.transactions)
+
+        try:
+            settlement = flow_algorithms.Settle.simplify(
+                debt, cancel_cycles=True, budget=budget
+            )
+        except flow_algorithms.NoSimplification as e:
+            if not netted:
+                raise e
+
+            return self.debt_graph()
+
+        if settlement.cancelled:
+            logger.info(
+                f"Cancelled {settlement.cancelled} of debt going round in cycles"
+            )
+
+        if settlement.partial:
+            logger.info(
+                "Ran out of time simplifying; the ledger is only partly simplified"
             )
 
+        return settlement.graph
+
+    def debt_graph(self) -> flow.FlowGraph:
+        """Returns a graph of who owes who. Transactions between the same two users are netted: at most one edge
+        is left between them, for the amount still owed"""
+
+        if len(self.transactions) >= VECTORISE_MIN_TRANSACTIONS:
+            users, src, dest, amount = self.arrays()
+            vertices = [flow.Vertex(*usr) for usr in users]
+            src, dest, amount = vectorised.net_debts(src, dest, amount, len(users))
+
+            return flow.CompactFlowGraph.from_netted(
+                vertices, src.tolist(), dest.tolist(), amount.tolist()
+            )
+
+        # build a map of user ids to vertices for all users in graph
+        users_vertices = {usr[0]: flow.Vertex(*usr) for usr in self.users}
+
+        # build a graph including everyone in the household, with the netted transactions as edges
+        debt = flow.CompactFlowGraph.from_debts(
+            [v for v in users_vertices.values()],
+            (
+                (users_vertices[t.src_id], users_vertices[t.dest_id], t.amount)
+                for t in self.transactions
+            ),
+        )
+
         # debt.draw("pre_simplify", subdir='ledger', res=False)
 
+        return debt
+
+    @staticmethod
+    def fingerprint_house(
+        house_id: int, cur: cursor.MySQLCursor
+    ) -> tuple[str, frozenset[int]]:
+        """Returns a stable hash of a house's unpaid transactions, and their ids. A single query with no names,
+        so it is much cheaper than building the house's ledger"""
+        cur.execute(
+            "SELECT transaction.id, p.src, p.dest, amount FROM transaction "
+            "INNER JOIN pairs p on transaction.pair_id = p.id "
+            "INNER JOIN user u on p.src = u.id "
+            "WHERE u.household_id = %s AND paid = 0 "
+            "ORDER BY transaction.id;",
+            [house_id],
+        )
+
+        rows: list[tuple[int, int, int, int]] = [tuple(row) for row in cur.fetchall()]  # type: ignore
+
+        return Ledger.fingerprint_rows(rows), frozenset(row[0] for row in rows)
+
+    @staticmethod
+    def fingerprint_rows(rows: list[tuple[int, int, int, int]]) -> str:
+        """Returns a stable hash of (id, src id, dest id, amount) rows of transactions, in id order"""
+        return hashlib.sha256(json.dumps(rows).encode()).hexdigest()
+
+    @property
+    def fingerprint(self) -> str:
+        """Returns fingerprint_rows of the ledger's transactions. For a ledger of a household's unpaid transactions,
+        in id order, this is the hash fingerprint_house gives while the transactions are unchanged
+        """
+        return Ledger.fingerprint_rows(
+            [(t.t_id, t.src_id, t.dest_id, t.amount) for t in self.transactions]
+        )
+
+    @staticmethod
+    def invalidate(*, house_id: int | None = None, t_id: int | None = None):
+        """Drops cached simplifications of a household, or of whichever household holds transaction t_id.
+        Incremental graphs holding t_id are dropped too (a transaction paid or deleted can't be folded in)
+        """
+        for key, cached in simplification_cache.items():
+            if key[0] == house_id or t_id in cached.t_ids:
+                simplification_cache.pop(key)
+
+        if t_id is None:
+            return
+
+        for state_house_id, state in incremental_states.items():
+            if t_id in state.t_ids:
+                incremental_states.pop(state_house_id)
+
+    @staticmethod
+    def fold_in(transaction: Transaction):
+        """Adds a newly inserted transaction to its household's incrementally simplified graph.
+        Does nothing if the household isn't being simplified incrementally"""
+        if transaction.paid:
+            return
+
+        if (state := incremental_states.get(transaction.house_id)) is None:
+            return
+
+        with state.lock:
+            # reuse the vertices already in the graph so users are matched by id
+            src, dest = [
+                state.vertices.setdefault(u_id, flow.Vertex(u_id, name))
+                for u_id, name in [
+                    (transaction.src_id, transaction.src_name),
+                    (transaction.dest_id, transaction.dest_name),
+                ]
+            ]
+
+            state.settle.add_debt(src, dest, transaction.amount)
+            state.t_ids.add(transaction.t_id)
+
+    @staticmethod
+    def plan(
+        household_id: int,
+        cur: cursor.MySQLCursor,
+        method: str = "max_flow",
+        incremental: bool = False,
+        budget: flow_algorithms.Budget | None = None,
+        keep_partial: bool = False,
+    ) -> SimplificationPlan:
+        """Works out how to simplify a household's unpaid transactions, without writing anything.
+        Raises NoSimplification if no simplifications can be made.
+
+        Plans are cached by a fingerprint of the transactions (see simplification_cache), so writing a plan with
+        Ledger.simplify doesn't work it out again while the transactions are unchanged. Plans cut short by the
+        budget are only cached with keep_partial set, e.g. for a preview that's about to be confirmed.
+        """
+
+        # outcome of simplifying these exact transactions before, if there is one
+        fingerprint, t_ids = Ledger.fingerprint_house(household_id, cur)
+        key = (household_id, method, fingerprint)
+        cached = simplification_cache.get(key)
+
+        if cached is not None and cached.simplified is None:
+            logger.warning("No Simplifications found (cached)")
+            raise flow_algorithms.NoSimplification("No simplifications were made")
+
+        # get ledger of all unmarked transaction_resources in the house
+        ledger = Ledger.build_from_house_id(household_id, cur)
+
+        # transactions changed between the two queries, so the cached result may not cover them all
+        if {t.t_id for t in ledger.transactions} != t_ids:
+            cached = None
+
+        if cached is not None:
+            return SimplificationPlan(ledger, cached.simplified, key, cached.partial)  # type: ignore
+
         try:
-            simplified = flow_algorithms.Settle.simplify_debt(debt)
+            simplified = None
+            if incremental:
+                simplified = Ledger._incremental_simplified(ledger, household_id)
+            if simplified is None:
+                simplified = ledger.simplified(method, budget)
         except flow_algorithms.NoSimplification as e:
+            # given more time there may have been simplifications, so only remember a complete search
+            if budget is None or not budget.ran_out:
+                simplification_cache.put(key, CachedSimplification(t_ids, None))
+
+            # the ledger is as simple as it gets; keep it as the household's graph
+            if incremental:
+                incremental_states.put(
+                    household_id,
+                    IncrementalState.build(
+                        {t.t_id for t in ledger.transactions}, ledger.debt_graph()
+                    ),
+                )
+
             # log and propagate upwards
             logger.warning("No Simplifications found")
             raise e
 
-        # otherwise
+        partial = budget is not None and budget.ran_out
+
+        # keep the result until it has been written, so a failed write doesn't mean simplifying again.
+        # partial results aren't kept unless asked; a retry may as well use its own budget to get further
+        if not partial or keep_partial:
+            simplification_cache.put(
+                key, CachedSimplification(t_ids, simplified, partial)
+            )
+
+        return SimplificationPlan(ledger, simplified, key, partial)
+
+    @staticmethod
+    def simplify(
+        household_id: int,
+        cur: cursor.MySQLCursor,
+        conn: MySQLConnection,
+        method: str = "max_flow",
+        incremental: bool = False,
+        budget: flow_algorithms.Budget | None = None,
+    ) -> SimplificationPlan:
+        """Simplifies all unmarked transaction_resources in a group. Returns the plan that was written.
+
+        With incremental set, the household's simplified graph is kept after simplifying, and transactions added
+        later are folded into it (see Ledger.fold_in). The next incremental simplify then writes that graph
+        without simplifying the whole ledger again, as long as it covers exactly the unpaid transactions.
+
+        With a budget, simplifying stops when it runs out and the best simplification found so far is written
+        (budget.ran_out is set). Simplifying again carries on from there, as the written transactions are simpler.
+
+        1. Works out how to simplify the open (i.e. unpaid) transaction_resources of a house (see Ledger.plan);
+           a plan cached by an earlier preview or failed write is used as is
+        2a. If no simplifications were found, report no simplifications made
+        2b. If there are simplifications to be made, in one database transaction (see replace_transactions):
+            * Add new transaction_resources from the simplified model
+            * Delete the old transaction_resources
+        """
+        plan = Ledger.plan(household_id, cur, method, incremental, budget)
+        ledger, simplified, key = plan.ledger, plan.simplified, plan.key
+
         #   1. build new ledger from flow graph
         #   2. delete old transaction_resources
         #   3. add new transaction_resources to db
 
-        simplified.draw("simplified", subdir="ledger", res=False)
-
         # build new ledger
         simplified_ledger = Ledger([])
 
@@ -208,25 +752,64 @@ class Ledger:
                     )
                 )
 
-        # try to insert new transaction_resources
+        # add the new transaction_resources and delete the old ones together; if anything fails, nothing is changed
         try:
-            for transaction in simplified_ledger.transactions:
-                transaction.insert_transaction(cur, conn)
-        except TransactionInsertionFailed:
-            # means something failed so remove anything that may have been added and add back old transaction_resources
-            for t_id in [t.t_id for t in simplified_ledger.transactions]:
-                cur.execute("""DELETE FROM transaction WHERE id = %s""", [t_id])
-
+            replace_transactions(
+                cur,
+                [t.t_id for t in ledger.transactions],
+                simplified_ledger.transactions,
+            )
+            conn.commit()
+        except mysql.connector.Error as e:
+            conn.rollback()
             raise SimplificationError(
                 "Found a way to simplify debts; failed to execute. Try again later"
+            ) from e
+
+        # the household's transactions have changed, so the cached result is no longer needed
+        simplification_cache.pop(key)
+
+        # only recorded once written, so a failed write never shows. Rendering is left until the graph is asked
+        # for (see transactions.render)
+        render.record(household_id, simplified)
+
+        if incremental:
+            incremental_states.put(
+                household_id,
+                IncrementalState.build(
+                    {t.t_id for t in simplified_ledger.transactions}, simplified
+                ),
+            )
+
+        return plan
+
+    @staticmethod
+    def _incremental_simplified(
+        ledger: Ledger, household_id: int
+    ) -> flow.FlowGraph | None:
+        """Returns a copy of the household's incrementally simplified graph, or None where there isn't one
+        that matches the ledger. Raises NoSimplification if the graph is the same as the ledger
+        """
+        if (state := incremental_states.get(household_id)) is None:
+            return None
+
+        with state.lock:
+            # transactions have been paid or deleted since, so the graph is out of date
+            if state.t_ids != {t.t_id for t in ledger.transactions}:
+                incremental_states.pop(household_id)
+                return None
+
+            simplified = state.settle.graph.subgraph(
+                [v for v in state.settle.graph.graph.keys()]
             )
 
-        # delete old transaction_resources only if we have successfully added new ones
-        for t_id in [t.t_id for t in ledger.transactions]:
-            cur.execute("""DELETE FROM transaction WHERE id = %s""", [t_id])
+        debt = ledger.debt_graph()
+        if simplified.fingerprint() == debt.fingerprint() and debt.edge_count() == len(
+            ledger.transactions
+        ):
+            raise flow_algorithms.NoSimplification("No simplifications were made")
 
-        # commit
-        conn.commit()
+        return simplified
 
     def as_events(self) -> list[CalendarEvent]:
         """Converts transactions into calendar event objects"""
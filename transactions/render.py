@@ -0,0 +1,85 @@
+"""Renders simplified debt graphs for the frontend, off the /simplify request path.
+
+Simplifying only remembers the graph. The DOT source and SVG are made the first time they are asked for (or by a
+worker thread, where asked to), and are cached by a hash of the graph, so the same graph is never rendered twice
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import graphviz  # type: ignore
+
+from settle import flow
+from transactions.cache import LRUCache
+
+# graph hash -> graph, DOT source and rendered SVG
+graphs: LRUCache[str, flow.FlowGraph] = LRUCache(maxsize=256)
+sources: LRUCache[str, str] = LRUCache(maxsize=256)
+svgs: LRUCache[str, bytes] = LRUCache(maxsize=64)
+
+# household id -> hash of the household's latest simplified graph
+latest: LRUCache[int, str] = LRUCache(maxsize=1024)
+
+# set to render every simplified graph's SVG as soon as it is recorded, rather than when it's first asked for
+RENDER_IN_BACKGROUND = False
+
+# renders SVGs in the background; one thread is plenty as renders are rare and cached
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+
+
+def graph_hash(graph: flow.FlowGraph) -> str:
+    """Returns a hash of everything that changes how the graph is drawn: its vertices and its edges"""
+    vertices = sorted((v.v_id, v.label) for v in graph.graph.keys())
+    edges = sorted(graph.fingerprint())
+
+    return hashlib.sha256(json.dumps([vertices, edges]).encode()).hexdigest()
+
+
+def record(
+    house_id: int, graph: flow.FlowGraph, *, background: bool | None = None
+) -> str:
+    """Remembers a copy of graph as the household's latest simplified graph and returns its hash; the graph itself
+    may go on to be changed, e.g. by folding in new transactions. Nothing is rendered here; with background set
+    (RENDER_IN_BACKGROUND by default), the SVG is rendered by a worker thread"""
+    if background is None:
+        background = RENDER_IN_BACKGROUND
+
+    key = graph_hash(graph)
+
+    graphs.put(key, flow.FlowGraph.unpack(graph.pack()))
+    latest.put(house_id, key)
+
+    if background and key not in svgs:
+        executor.submit(svg, key)
+
+    return key
+
+
+def dot_source(key: str) -> str | None:
+    """Returns the DOT source of the graph with the given hash, or None if the graph isn't known"""
+    if (source := sources.get(key)) is not None:
+        return source
+
+    if (graph := graphs.get(key)) is None:
+        return None
+
+    source = graph.dot(res=False).source
+    sources.put(key, source)
+
+    return source
+
+
+def svg(key: str) -> bytes | None:
+    """Returns the graph with the given hash rendered as an SVG, or None if the graph isn't known"""
+    if (image := svgs.get(key)) is not None:
+        return image
+
+    if (source := dot_source(key)) is None:
+        return None
+
+    image = graphviz.Source(source).pipe(format="svg")
+    svgs.put(key, image)
+
+    return image
@@ -2,11 +2,15 @@ from __future__ import annotations
 
 import datetime
 import json
+from collections import defaultdict, deque
 from dataclasses import dataclass
 
+import mysql.connector
 import requests
 from mysql.connector import cursor, MySQLConnection
 
+from transactions.cache import LRUCache
+
 
 class TransactionConstructionError(Exception):
     """Triggered when a transaction failed to build from the database"""
@@ -16,6 +20,142 @@ class TransactionInsertionFailed(Exception):
     ...
 
 
+# every column Transaction is built from, in order, with the names of both users and the household. Add a WHERE
+# clause to pick the transactions, then build each row with Transaction.from_row
+SELECT_TRANSACTIONS = (
+    "SELECT transaction.id, u1.id, u2.id, CONCAT_WS(' ', u1.first_name, u1.surname), "
+    "CONCAT_WS(' ', u2.first_name, u2.surname), amount, description, due_date, paid, u1.household_id "
+    "FROM transaction "
+    "INNER JOIN pairs ON pairs.id = transaction.pair_id "
+    "INNER JOIN user u1 ON u1.id = pairs.src "
+    "INNER JOIN user u2 ON u2.id = pairs.dest"
+)
+
+# ids per DELETE ... IN list, so one statement never gets too long
+DELETE_CHUNK = 500
+
+# (src id, dest id) -> id of the pair in the pairs table. Only committed pairs are cached; a pair's id never changes
+# while it exists, and pairs are only deleted along with their users (see forget_pairs)
+pair_id_cache: LRUCache[tuple[int, int], int] = LRUCache(maxsize=4096)
+
+
+def forget_pairs(user_id: int):
+    """Drops every cached pair the user is in; for when their pairs are deleted"""
+    for src, dest in list(pair_id_cache):
+        if user_id in (src, dest):
+            pair_id_cache.pop((src, dest))
+
+
+def pair_ids(
+    cur: cursor.MySQLCursor, pairs: set[tuple[int, int]]
+) -> dict[tuple[int, int], int]:
+    """Returns the id of every (src, dest) pair, adding the pairs that aren't in the pairs table yet. Pairs are
+    looked up in pair_id_cache first, then at most three queries however many pairs are left: one to find them,
+    one executemany to add the missing ones and one to find those. Doesn't commit.
+
+    Raises mysql.connector.Error if a pair couldn't be added"""
+    ids: dict[tuple[int, int], int] = {}
+    for pair in pairs:
+        if (p_id := pair_id_cache.get(pair)) is not None:
+            ids[pair] = p_id
+
+    def find(srcs: set[int]) -> dict[tuple[int, int], int]:
+        cur.execute(
+            f"SELECT id, src, dest FROM pairs WHERE src IN ({', '.join(['%s'] * len(srcs))})",
+            sorted(srcs),
+        )
+        rows: list[tuple[int, int, int]] = cur.fetchall()  # type: ignore
+        found = {(src, dest): p_id for p_id, src, dest in rows if (src, dest) in pairs}
+
+        ids.update(found)
+        return found
+
+    if not (missing := pairs - ids.keys()):
+        return ids
+
+    # these pairs are already committed, so can be cached now
+    for pair, p_id in find({src for src, _ in missing}).items():
+        pair_id_cache.put(pair, p_id)
+
+    # the new pairs are only cached once they have been committed (by a later insert_transaction, say), in case
+    # the caller rolls back. Another request may add the same pair first; the duplicate key is left as it is, and
+    # its id is found either way. Anything else wrong with a pair (a user that doesn't exist, say) is an error
+    if added := sorted(pairs - ids.keys()):
+        cur.executemany(
+            "INSERT INTO pairs (src, dest) VALUES (%s, %s) ON DUPLICATE KEY UPDATE id = id",
+            added,
+        )
+        find({src for src, _ in added})
+
+    if lost := pairs - ids.keys():
+        raise mysql.connector.Error(f"Could not add pairs {sorted(lost)}")
+
+    return ids
+
+
+def replace_transactions(
+    cur: cursor.MySQLCursor, old_ids: list[int], new: list[Transaction]
+):
+    """Adds the new transactions and deletes the transactions with ids old_ids, in a handful of queries: pair ids
+    are resolved in bulk (see pair_ids), the new transactions added with one executemany and their ids read back
+    with one query, and the old ones deleted DELETE_CHUNK at a time. Sets the t_id of every new transaction.
+
+    Doesn't commit; the caller commits, or rolls back on an error (mysql.connector.Error, raised here too if the
+    new transactions weren't all added), so either all of it happens or none of it does
+    """
+    p_ids = pair_ids(cur, {(t.src_id, t.dest_id) for t in new})
+
+    if new:
+        cur.executemany(
+            "INSERT INTO transaction(pair_id, amount, description, due_date, paid) VALUES (%s, %s, %s, %s, %s)",
+            [
+                (
+                    p_ids[(t.src_id, t.dest_id)],
+                    t.amount,
+                    t.description,
+                    t.due.isoformat(),
+                    1 if t.paid else 0,
+                )
+                for t in new
+            ],
+        )
+
+        # executemany sends the rows as one multi-row INSERT; lastrowid is the id of its first row
+        if not (first_id := cur.lastrowid) or cur.rowcount != len(new):
+            raise mysql.connector.Error("Not every new transaction was added")
+
+        # the ids aren't necessarily consecutive (see db/README.md), so they are read back, from no further than
+        # the statement's last id could be. The rows were added in order, so ids of rows with the same pair and
+        # amount are handed out in order too
+        pairs = sorted({p_ids[(t.src_id, t.dest_id)] for t in new})
+        cur.execute(
+            "SELECT id, pair_id, amount FROM transaction "
+            "WHERE id BETWEEN %s AND %s + %s * @@auto_increment_increment "
+            f"AND pair_id IN ({', '.join(['%s'] * len(pairs))}) ORDER BY id",
+            [first_id, first_id, len(new) - 1, *pairs],
+        )
+        rows: list[tuple[int, int, int]] = cur.fetchall()  # type: ignore
+
+        added: defaultdict[tuple[int, int], deque[int]] = defaultdict(deque)
+        for t_id, pair_id, amount in rows:
+            added[(pair_id, amount)].append(t_id)
+
+        for transaction in new:
+            key = (p_ids[(transaction.src_id, transaction.dest_id)], transaction.amount)
+            if not added[key]:
+                raise mysql.connector.Error(
+                    "Could not read back the new transactions' ids"
+                )
+            transaction.t_id = added[key].popleft()
+
+    for i in range(0, len(old_ids), DELETE_CHUNK):
+        chunk = old_ids[i : i + DELETE_CHUNK]
+        cur.execute(
+            f"DELETE FROM transaction WHERE id IN ({', '.join(['%s'] * len(chunk))})",
+            chunk,
+        )
+
+
 @dataclass
 class Transaction:
     """Specifies a singular transaction"""
@@ -31,6 +171,22 @@ class Transaction:
     paid: bool
     house_id: int
 
+    @property
+    def as_dict(self) -> dict:
+        """Returns the transaction as a dict, with the same keys and values as json"""
+        return {
+            "transaction_id": self.t_id,
+            "src_id": self.src_id,
+            "dest_id": self.dest_id,
+            "src": self.src_name,
+            "dest": self.dest_name,
+            "amount": self.amount,
+            "description": self.description,
+            "due_date": self.due.isoformat(),
+            "paid": "true" if self.paid else "false",
+            "household_id": self.house_id,
+        }
+
     @property
     def json(self) -> str:
         """Returns a JSON representation of transaction object of the format
@@ -48,20 +204,7 @@ class Transaction:
         }
         """
         try:
-            dump = json.dumps(
-                {
-                    "transaction_id": self.t_id,
-                    "src_id": self.src_id,
-                    "dest_id": self.dest_id,
-                    "src": self.src_name,
-                    "dest": self.dest_name,
-                    "amount": self.amount,
-                    "description": self.description,
-                    "due_date": self.due.isoformat(),
-                    "paid": "true" if self.paid else "false",
-                    "household_id": self.house_id,
-                }
-            )
+            dump = json.dumps(self.as_dict)
             return dump
 
         except json.decoder.JSONDecodeError as je:
@@ -72,12 +215,7 @@ class Transaction:
         """Builds a transaction from an id in the db and a cursor to said database"""
 
         cur.execute(
-            "SELECT transaction.id, u1.id, u2.id,  CONCAT_WS(' ', u1.first_name, u1.surname), "
-            "CONCAT_WS(' ', u2.first_name, u2.surname), amount, description, due_date, paid, u1.household_id "
-            "FROM transaction, pairs, user u1, user u2 "
-            "WHERE transaction.id = %s AND pairs.id = transaction.pair_id"
-            " AND u1.id = pairs.src AND u2.id = pairs.dest",
-            [transaction_id],
+            SELECT_TRANSACTIONS + " WHERE transaction.id = %s", [transaction_id]
         )
 
         # only one row will match an ID
@@ -89,15 +227,18 @@ class Transaction:
                 "Couldn't find transaction in the database; "
                 "likely due to invalid transaction ID"
             )
-        else:
-            args: list = [element for element in row]
 
-        # args is in the form
-        # [transaction_id: int, src_id: int, dest_id: int, amount: int, due_date: str, paid: int,
-        # description: str, src_name: str, dest_name: str]
+        return Transaction.from_row(row)
+
+    @staticmethod
+    def from_row(row: tuple) -> Transaction:
+        """Builds a transaction from a row of SELECT_TRANSACTIONS"""
 
-        # need to convert paid from int -> bool
-        # do in place so can pass tuple directly into Transaction() instantiation
+        # row is in the form
+        # (transaction_id: int, src_id: int, dest_id: int, src_name: str, dest_name: str, amount: int,
+        # description: str, due_date: datetime.date, paid: int, household_id: int)
+
+        args: list = [element for element in row]
 
         # convert paid in {0, 1} -> True/False
         args[-2] = bool(args[-2])
@@ -142,38 +283,20 @@ class Transaction:
         ][1:]
 
     def insert_transaction(self, cur: cursor.MySQLCursor, conn: MySQLConnection):
-        """Inserts transaction into table"""
-
-        # cur.fetchall()
-
-        # get pair id
-        cur.execute(
-            "SELECT id FROM pairs WHERE src = %s AND dest = %s",
-            [self.src_id, self.dest_id],
-        )
-        p_id = cur.fetchone()
-
-        # add pair to pairs table if the pair doesn't already exist
-        if p_id is None:
-            cur.execute(
-                "INSERT INTO pairs (src, dest) VALUES (%s, %s)",
-                [self.src_id, self.dest_id],
-            )
+        """Inserts transaction into table, and sets its t_id. One query and a commit where the pair (src, dest) is
+        cached in pair_id_cache, two otherwise"""
 
-            conn.commit()
+        pair = (self.src_id, self.dest_id)
 
-            # get id from pair entry that was just generated
+        # get pair id; unknown pairs are added, or the id of the existing pair is got back, in the same query
+        if (pair_id := pair_id_cache.get(pair)) is None:
             cur.execute(
-                "SELECT id FROM pairs WHERE src = %s AND dest = %s",
+                "INSERT INTO pairs (src, dest) VALUES (%s, %s) ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)",
                 [self.src_id, self.dest_id],
             )
-            p_id = cur.fetchone()
-
-            # commit changes
-            conn.commit()
-
-        # unpack p_id from tuple
-        pair_id = p_id[0]
+            if not (pair_id := cur.lastrowid):
+                conn.rollback()
+                raise TransactionInsertionFailed
 
         # insert new Transaction object into the database
         cur.execute(
@@ -188,20 +311,16 @@ class Transaction:
             ],
         )
 
-        # commit
-        conn.commit()
+        if not (t_id := cur.lastrowid):
+            conn.rollback()
+            raise TransactionInsertionFailed
 
-        # update the id of the new transaction
-        cur.execute(
-            "SELECT id FROM transaction WHERE pair_id = %s AND amount = %s AND due_date = %s AND paid = %s",
-            [pair_id, self.amount, self.due, 1 if self.paid == "true" else 0],
-        )
+        # commit the pair and the transaction together
+        conn.commit()
+        pair_id_cache.put(pair, pair_id)
 
-        if (t_id := cur.fetchone()) is None:
-            raise TransactionInsertionFailed
-        else:
-            # update trn to have the correct ID
-            self.t_id = t_id
+        # update trn to have the correct ID
+        self.t_id = t_id
 
 
 @dataclass
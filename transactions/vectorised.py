@@ -0,0 +1,41 @@
+"""Vectorised versions of Ledger's per-transaction loops, for large ledgers.
+
+Transactions are given as integer arrays of the same length: src and dest (users, as positions 0..n-1 in the
+ledger's list of users) and amount
+"""
+import numpy as np
+
+
+def net_balances(
+    src: np.ndarray, dest: np.ndarray, amount: np.ndarray, n: int
+) -> np.ndarray:
+    """Returns how much each of the n users is owed overall; negative where they owe money"""
+    balances = np.zeros(n, dtype=np.int64)
+    np.add.at(balances, dest, amount)
+    np.subtract.at(balances, src, amount)
+
+    return balances
+
+
+def net_debts(
+    src: np.ndarray, dest: np.ndarray, amount: np.ndarray, n: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Nets debts between the same two users. Returns (src, dest, amount) arrays with at most one debt between
+    any two users, for the amount still owed, ordered by pair. Debts owed to yourself and debts that cancel
+    out are dropped"""
+
+    # every pair of users gets one key, whichever way the debt goes; debts going from the higher position to the
+    # lower one count as negative
+    low, high = np.minimum(src, dest), np.maximum(src, dest)
+    signed = np.where(src < dest, amount, -amount)
+
+    keys, pair = np.unique(low * n + high, return_inverse=True)
+    net = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(net, pair, signed)
+
+    low, high = keys // n, keys % n
+    owed = (net != 0) & (low != high)
+    low, high, net = low[owed], high[owed], net[owed]
+
+    forward = net > 0
+    return np.where(forward, low, high), np.where(forward, high, low), np.abs(net)